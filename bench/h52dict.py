@@ -0,0 +1,63 @@
+# benchmark for the parallel read path of dataAnalysis.h52dict.
+# reads a store with the serial path and with process pools of different sizes.
+# usage: py bench/h52dict.py [-frames 5000] [-rows 1000] [-workers 2 4 8 16 32]
+# the store is written to tmp/bench_h52dict.h5 and reused if it has the same size.
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from parcoords.dataAnalysis import dict2h5, h52dict
+
+PATH = Path("tmp/bench_h52dict.h5")
+
+
+def mkStore(frames, rows):
+    tag = f"{frames}x{rows}"
+    if PATH.is_file():
+        with pd.HDFStore(PATH, mode="r") as store:
+            if getattr(store._handle.root._v_attrs, "bench_tag", None) == tag:
+                return PATH
+        PATH.unlink()
+    PATH.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 1, rows)
+    dct = {}
+    for idx in range(frames):
+        df = pd.DataFrame({"t": t, "y": rng.random(rows), "z": rng.random(rows)})
+        df.set_index("t", inplace=True)
+        df.attrs["in_idx"] = idx
+        dct[f"d{idx}"] = df
+    dict2h5(dct, PATH)
+    with pd.HDFStore(PATH) as store:
+        store._handle.root._v_attrs.bench_tag = tag
+    return PATH
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-frames", type=int, default=5000)
+    p.add_argument("-rows", type=int, default=1000)
+    p.add_argument("-workers", type=int, nargs="+", default=[2, 4, 8, 16, 32])
+    args = p.parse_args()
+
+    path = mkStore(args.frames, args.rows)
+    print(f"{args.frames} frames x {args.rows} rows, {os.cpu_count()} cpus")
+    results = []
+    for workers in [1] + args.workers:
+        t0 = time.perf_counter()
+        dct = h52dict(path, workers=workers)
+        dt = time.perf_counter() - t0
+        assert len(dct) == args.frames
+        del dct
+        speedup = results[0][1] / dt if results else 1.0
+        results.append([workers, dt, speedup])
+        print(f"workers={workers:>3}: {dt:8.3f}s, speedup {speedup:5.2f}")
+    return pd.DataFrame(results, columns=["workers", "s", "speedup"])
+
+
+if __name__ == "__main__":
+    main()
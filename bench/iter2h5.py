@@ -0,0 +1,59 @@
+# benchmark for the streaming writer dataAnalysis.iter2h5.
+# writes generated runs and reports the runtime and the peak of the memory that
+# python allocated while writing. the peak should not grow with the number of runs
+# (apart from the metadata dicts, that are kept for the index).
+# usage: py bench/iter2h5.py [-runs 1000 10000 100000] [-rows 1000] [-complib zlib]
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from parcoords.dataAnalysis import iter2h5
+
+PATH = Path("tmp/bench_iter2h5.h5")
+
+
+def mkRuns(runs, rows):
+    t = np.linspace(0, 1, rows)
+    rng = np.random.default_rng(0)
+    for idx in range(runs):
+        df = pd.DataFrame({"t": t, "y": rng.random(rows)})
+        df.set_index("t", inplace=True)
+        df.attrs["in_idx"] = idx
+        yield f"d{idx}", df
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-runs", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5])
+    p.add_argument("-rows", type=int, default=1000)
+    p.add_argument("-complib", default=None)
+    p.add_argument("-complevel", type=int, default=0)
+    args = p.parse_args()
+
+    PATH.parent.mkdir(parents=True, exist_ok=True)
+    results = []
+    for runs in args.runs:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        iter2h5(
+            mkRuns(runs, args.rows),
+            PATH,
+            mode="w",
+            complevel=args.complevel,
+            complib=args.complib,
+        )
+        dt = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        results.append([runs, dt, peak])
+        print(f"runs={runs:>7}: {dt:8.3f}s, peak {peak:8.1f}MB")
+    PATH.unlink()
+    return pd.DataFrame(results, columns=["runs", "s", "peak MB"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# benchmark for dataAnalysis.getMetaMatrix.
+# the runtime per (row x metadata key) should stay constant, ie scale linearly.
+# usage: py bench/metaMatrix.py [-rows 1000 10000 ...] [-keys 20 200]
+# note that the input dicts for 10^6 rows x 200 keys alone need ~20GB of RAM.
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from parcoords.dataAnalysis import getMetaMatrix
+
+
+class AttrsOnly:
+    # getMetaMatrix only needs the attrs, so we dont create real dataframes
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+
+def mkData(rows, keys):
+    names = [f"key{x:03d}" for x in range(keys)]
+    vals = np.random.default_rng(0).random((rows, keys)).tolist()
+    return dict(
+        (f"/d{idx}", AttrsOnly(dict(zip(names, row)))) for idx, row in enumerate(vals)
+    )
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-rows", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+    )
+    p.add_argument("-keys", type=int, nargs="+", default=[20, 200])
+    args = p.parse_args()
+
+    results = []
+    for keys in args.keys:
+        for rows in args.rows:
+            data = mkData(rows, keys)
+            t0 = time.perf_counter()
+            meta = getMetaMatrix(data)
+            dt = time.perf_counter() - t0
+            assert meta.shape == (rows, keys)
+            del data, meta
+            ns = dt / (rows * keys) * 1e9
+            results.append([rows, keys, dt, ns])
+            print(f"rows={rows:>8} keys={keys:>4}: {dt:8.3f}s, {ns:6.1f}ns per value")
+    return pd.DataFrame(results, columns=["rows", "keys", "s", "ns/value"])
+
+
+if __name__ == "__main__":
+    main()
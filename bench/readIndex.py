@@ -0,0 +1,63 @@
+# benchmark for opening a store through its metadata index, see dataAnalysis.read.
+# an unchanged file is trusted by its size and mtime, so the time should not grow
+# with the number of nodes. after a write that did not come from this module, the
+# nodes are listed once to check the index. fails if the first read takes longer
+# than -limit seconds.
+# usage: py bench/readIndex.py [-runs 50000] [-limit 1.0]
+# the store is written to tmp/bench_readIndex_<runs>.h5 and reused, writing 50000
+# runs takes a few minutes.
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from parcoords.dataAnalysis import iter2h5, read, stampIndex
+
+
+def mkRuns(runs, rows):
+    t = np.linspace(0, 1, rows)
+    for idx in range(runs):
+        df = pd.DataFrame({"t": t, "y": t * idx})
+        df.set_index("t", inplace=True)
+        df.attrs["in_idx"] = idx
+        yield f"d{idx}", df
+
+
+def timedRead(path):
+    t0 = time.perf_counter()
+    with read(path) as data:
+        dt = time.perf_counter() - t0
+        assert data.index is not None
+    return dt
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-runs", type=int, default=50000)
+    p.add_argument("-limit", type=float, default=1.0)
+    args = p.parse_args()
+
+    path = Path(f"tmp/bench_readIndex_{args.runs}.h5")
+    if not path.is_file():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        iter2h5(mkRuns(args.runs, 10), path, mode="w")
+    stampIndex(path)
+
+    unchanged = timedRead(path)
+    print(f"runs={args.runs}: {unchanged:8.3f}s to read an unchanged store")
+    # a newer mtime, as if somebody else had written the file
+    os.utime(path)
+    touched = timedRead(path)
+    print(f"runs={args.runs}: {touched:8.3f}s to read it after a foreign write")
+    stampIndex(path)
+    assert unchanged < args.limit, f"reading took {unchanged:.3f}s"
+    return pd.DataFrame(
+        [[args.runs, unchanged, touched]], columns=["runs", "s", "s touched"]
+    )
+
+
+if __name__ == "__main__":
+    main()
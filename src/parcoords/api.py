@@ -4,7 +4,9 @@ from parcoords import log as logging
 log = logging.getLogger()
 
 read = dataAnalysis.read
+upgrade = dataAnalysis.upgrade
+query = dataAnalysis.query
 
 
-def show(data):
-    dataVisualisation.visualize(data)
+def show(data, backend=None, watch=False):
+    dataVisualisation.visualize(data, backend=backend, watch=watch)
@@ -1,58 +1,1360 @@
 import errno
-import itertools as itt
+import glob
+import hashlib
 import os
+import pickle
+import shutil
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+from parcoords import log as logging
 from parcoords.exampledata import getExampleData
 
+log = logging.getLogger()
+
+CACHESIZE = 512 * 2 ** 20  # bytes of series data kept in memory by LazyDataDict
+METAKEY = "/_parcoords_meta"  # node of the persisted metadata index
+READWORKERS = 1  # processes used by h52dict, >1 reads the keys in parallel
+READCHUNKS = 4  # chunks of keys per worker, so workers can balance their load
+SHMTYPES = "biufcmM"  # dtype kinds that are sent through shared memory
+# blocks outlive the worker that wrote them only on posix. on windows, a block is
+# gone with its last handle, so the arrays are pickled there
+SHMBLOCKS = os.name == "posix"
+OPENWORKERS = 8  # processes that read the metadata of multi-file sources
+H5SUFFIXES = (".h5", ".hdf5", ".hdf")  # files that are read from a directory source
+CACHESUFFIX = ".pccache"  # folder next to a source, with its memory mapped cache
+CACHEVERSION = 1  # caches written with another version are rebuilt
+FLUSHEVERY = 1000  # keys written by iter2h5 between flushes of the store
+CALCWORKERS = 1  # processes for the per-dataset calc callbacks, see CalcCallback
+CALCBATCHSIZE = 256 * 2 ** 20  # bytes of frames the calc callbacks get at once
+DATAHASH = "_datahash"  # attrs key of the content hash of a stored frame
+STEPCHARACTERISTICS = ("os", "tr", "tm", "tp", "ess", "rms", "iae", "ise", "itae")
+STATSBINS = 10  # histogram bins of MetaStats
+
 
 # implements: e1
-def read(path):
+def read(
+    path,
+    progressive=False,
+    packed=False,
+    dtype=None,
+    cache=False,
+    workers=None,
+    persist=False,
+):
+    # path may also be a directory or a glob, all files are then read into one
+    # MultiDataDict. with progressive=True and no valid metadata index, the metadata
+    # of a single file is not read here. the returned mapping is empty, until someone
+    # (ie the DataLoader of the gui) walks the keys and adds them in chunks, and runs
+    # the calculations.
+    # with packed=True, all series are loaded into a RaggedData (optionally with the
+    # given dtype for the values, ie np.float32) and the source is closed again.
+    # with cache=True, a single file is read packed through its memory mapped cache,
+    # see dict2cache. the cache is (re)built if it is missing or stale.
+    # a single file is packed (or cached) by that many processes, see h52dict.
+    # with persist=True, the results of the calculations are written back into the
+    # source, see doCalculations.
     path = Path(path)
     if str(path) == "#example":
         path = getExampleData()
-    if not Path(path).is_file():
+    if cache and Path(path).is_file():
+        dct = readCached(path, dtype, workers)
+    elif packed and (workers or READWORKERS) > 1 and Path(path).is_file():
+        dct = RaggedData.fromFrames(h52dict(path, workers=workers), dtype)
+    else:
+        dct = openSource(path, progressive)
+    if packed and not isinstance(dct, RaggedData):
+        with dct:
+            dct = RaggedData.fromFrames(dct, dtype)
+    if dct.complete:
+        try:
+            dct.calcreport = doCalculations(dct, persist=persist)
+        except BaseException:
+            dct.close()
+            raise
+    else:
+        # for whoever runs the calculations later
+        dct.persist = persist
+    return dct
+
+
+def openSource(path, progressive=False):
+    # the lazy mapping of a file (or a directory or glob of files), see read
+    if str(path) == "#example":
+        path = getExampleData()
+    if Path(path).is_file():
+        return LazyDataDict(path, walk=not progressive)
+    files, root = findFiles(path)
+    if not files:
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+    return MultiDataDict(files, root)
 
-    dct = h52dict(path)
-    doCalculations(dct)
-    return dct
+
+def query(source, expr, subset=True):
+    # selects the datasets whose metadata match expr, a boolean expression over the
+    # columns of the metadata matrix in the syntax of DataFrame.eval: comparisons,
+    # ranges (1 < in_omega <= 3), &, |, ~ and in/not in lists (in_zeta in [0.1,
+    # 0.5]). other column names are quoted with backticks. it is evaluated on whole
+    # columns at once, compiled by numexpr if it is installed.
+    # source is a path (see read) or a mapping. a path is opened without running the
+    # calculations, with a valid metadata index no series is read.
+    # returns the matching keys, or with subset=True a SubsetData of them, that
+    # loads the series on access and can be shown like any other data.
+    opened = isinstance(source, (str, os.PathLike))
+    data = openSource(source) if opened else source
+    handedOver = False
+    try:
+        meta = getMetaMatrix(data)
+        mask = meta.eval(expr) if len(meta) else pd.Series([], dtype=bool)
+        if not isinstance(mask, pd.Series) or mask.dtype != bool:
+            raise ValueError(f"query {expr!r} is not a boolean expression")
+        keys = list(meta.index[mask.values])
+        handedOver = subset
+    finally:
+        # an opened source is closed on errors too, unless the subset owns it
+        if opened and not handedOver:
+            data.close()
+    if subset:
+        return SubsetData(data, keys, owned=opened)
+    return keys
+
+
+def findFiles(path):
+    # returns the files of a directory or glob source, and the folder their names
+    # are relative to
+    if Path(path).is_dir():
+        files = sorted(x for x in Path(path).rglob("*") if x.suffix in H5SUFFIXES)
+        return files, Path(path)
+    files = sorted(Path(x) for x in glob.glob(str(path), recursive=True))
+    files = [x for x in files if x.is_file()]
+    if not files:
+        return files, None
+    return files, Path(os.path.commonpath([x.parent for x in files]))
 
 
 calcCallbacks = []
 
 
-def addCalcCallback(cb):
+class CalcCallback:
+    # a registered calculation. without outputs, fn(dfs) gets the whole mapping and
+    # runs on every read. with outputs, fn(df) gets one dataset and returns a dict
+    # with the outputs, that is merged into its attrs. these results are cached per
+    # dataset: the hash of the inputs is kept in attrs["_calc_<name>"], and the
+    # dataset is only calculated again once it changes. columns are represented by
+    # the content hash of the dataset, see runCalcStage. bump version if fn changes.
+    # with batch=True, fn(dfs) gets the datasets that have to be calculated at once,
+    # as a dict key -> dataset, and returns a dict key -> outputs.
+    def __init__(self, fn, inputs=(), outputs=None, name=None, version=0, batch=False):
+        self.fn = fn
+        self.batch = batch
+        self.inputs = tuple(inputs)
+        self.outputs = None if outputs is None else tuple(outputs)
+        self.name = name or getattr(fn, "__qualname__", repr(fn))
+        self.version = version
+        self.cachekey = f"_calc_{self.name}"
+
+    def needsFrame(self, attrs):
+        return any(x not in attrs for x in self.inputs)
+
+    def hash(self, attrs, datahash=None):
+        # datahash stands for the inputs that are not in attrs, see frameHash
+        h = hashlib.sha1(f"{self.name}:{self.version}".encode())
+        for name in self.inputs:
+            if name in attrs:
+                val = attrs[name]
+                try:
+                    # values that went through the metadata index may be floats now
+                    h.update(np.float64(val).tobytes())
+                except (TypeError, ValueError):
+                    h.update(repr(val).encode())
+            else:
+                h.update((datahash or "missing").encode())
+        return h.hexdigest()
+
+
+def addCalcCallback(cb, inputs=(), outputs=None, name=None, version=0, batch=False):
     global calcCallbacks
+    cb = CalcCallback(cb, inputs, outputs, name, version, batch)
     calcCallbacks.append(cb)
+    return cb
+
+
+def calcStages(callbacks):
+    # groups the callbacks into stages that can run at the same time. a callback
+    # runs after the ones whose outputs it uses. whole-mapping callbacks have unknown
+    # inputs and outputs, they run alone, in the order they were added
+    stages = []
+    group = []
+    for cb in list(callbacks) + [None]:
+        if cb is not None and cb.outputs is not None:
+            group.append(cb)
+            continue
+        levels = {}
+        for other in group:
+            dependencyLevel(other, group, levels)
+        for level in sorted(set(levels.values())):
+            stages.append([x for x in group if levels[x] == level])
+        group = []
+        if cb is not None:
+            stages.append([cb])
+    return stages
+
+
+def dependencyLevel(cb, callbacks, levels, seen=()):
+    # dependency cycles are broken at the first callback that is visited again
+    if cb not in levels:
+        deps = [
+            x
+            for x in callbacks
+            if x is not cb and x not in seen and set(cb.inputs) & set(x.outputs)
+        ]
+        seen = seen + (cb,)
+        levels[cb] = max(
+            (dependencyLevel(x, callbacks, levels, seen) + 1 for x in deps), default=0
+        )
+    return levels[cb]
+
+
+def doCalculations(dfs, workers=None, persist=False):
+    # runs the calc callbacks (see CalcCallback) and writes changed results back into
+    # the store, if dfs supports it and persist is set. that changes the source file,
+    # so it is off by default. returns a report name -> dict
+    # with the runtime, the number of calculated and cached datasets, and the errors
+    # (exceptions by dataset key, or by None for whole-mapping callbacks). errors are
+    # also logged
+    # the report also names the callbacks that had to run in this process, because
+    # they cannot be sent to the workers (fallback, the reason)
+    workers = workers or CALCWORKERS
+    report = dict(
+        (cb.name, dict(time=0.0, calculated=0, cached=0, errors={}, fallback=None))
+        for cb in calcCallbacks
+    )
+    changed = set()
+    for stage in calcStages(calcCallbacks):
+        if stage[0].outputs is None:
+            cb = stage[0]
+            t0 = time.perf_counter()
+            try:
+                cb.fn(dfs)
+                report[cb.name]["calculated"] = len(dfs)
+            except Exception as e:
+                report[cb.name]["errors"][None] = e
+            report[cb.name]["time"] += time.perf_counter() - t0
+        else:
+            changed |= runCalcStage(dfs, stage, workers, report)
+
+    for name, entry in report.items():
+        for key, e in entry["errors"].items():
+            where = "" if key is None else f" on {key}"
+            log.warning(f"calc callback {name} failed{where}: {e!r}")
+    if persist and changed and hasattr(dfs, "persistAttrs"):
+        try:
+            dfs.persistAttrs(sorted(changed))
+        except (OSError, ValueError) as e:
+            log.warning(f"could not persist the calculated metadata: {e}")
+    return report
+
+
+def runCalcStage(dfs, stage, workers, report):
+    # returns the keys whose attrs changed. the frames are loaded and calculated in
+    # batches of about CALCBATCHSIZE bytes, so a lazy source stays within its cache.
+    # the content hash of a stored frame is kept in its attrs (and persisted with the
+    # results), so cached datasets are not loaded again on the next read. frames of
+    # other sources are hashed on every run
+    getattrs = getattr(dfs, "getattrs", lambda key: dfs[key].attrs)
+    stored = hasattr(dfs, "persistAttrs")
+    if workers > 1:
+        for cb in stage:
+            try:
+                pickle.dumps(cb.fn)
+            except Exception as e:
+                # ie lambdas and local functions
+                report[cb.name]["fallback"] = e
+                log.warning(f"calc callback {cb.name} runs serially: {e!r}")
+                workers = 1
+
+    changed = set()
+    batch = []
+    nbytes = 0
+    for key in dfs:
+        attrs = getattrs(key)
+        df = None
+        datahash = attrs.get(DATAHASH) if stored else None
+        if datahash is None and any(cb.needsFrame(attrs) for cb in stage):
+            df = dfs[key]
+            datahash = frameHash(df)
+            # loading may replace the attrs dict, see LazyDataDict.__getitem__
+            attrs = getattrs(key)
+            if stored:
+                attrs[DATAHASH] = datahash
+                changed.add(key)
+        todo = []
+        for cb in stage:
+            h = cb.hash(attrs, datahash)
+            if attrs.get(cb.cachekey) == h:
+                report[cb.name]["cached"] += 1
+            else:
+                todo.append((cb, h))
+        if not todo:
+            continue
+        df = dfs[key] if df is None else df
+        batch.append((key, todo, df))
+        nbytes += df.memory_usage(index=True).sum()
+        if nbytes >= CALCBATCHSIZE:
+            changed |= runCalcBatch(batch, getattrs, workers, report)
+            batch = []
+            nbytes = 0
+    if batch:
+        changed |= runCalcBatch(batch, getattrs, workers, report)
+    return changed
+
+
+def runCalcBatch(batch, getattrs, workers, report):
+    # batch: (key, [(callback, hash)], frame) per dataset. per-dataset callbacks get
+    # the frames one by one, batch callbacks all of theirs at once, split into one
+    # part per worker
+    single = [(key, [x for x in todo if not x[0].batch], df) for key, todo, df in batch]
+    single = [x for x in single if x[1]]
+    jobs = [([cb.fn for cb, _ in todo], df) for _, todo, df in single]
+    parts = []
+    for cb in dict.fromkeys(cb for _, todo, _ in batch for cb, _ in todo if cb.batch):
+        items = [(key, h, df) for key, todo, df in batch for x, h in todo if x is cb]
+        for idx in np.array_split(np.arange(len(items)), min(workers, len(items))):
+            part = [items[x] for x in idx]
+            parts.append((cb, part))
+            jobs.append(([cb.fn], dict((key, df) for key, _, df in part)))
 
+    fns = [x for x, _ in jobs]
+    args = [x for _, x in jobs]
+    if workers > 1 and len(jobs) > 1:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(runCalcs, fns, args, chunksize=chunksize))
+    else:
+        results = list(map(runCalcs, fns, args))
 
-def doCalculations(dfs):
-    for cb in calcCallbacks:
+    changed = set()
+    for (key, todo, _), result in zip(single, results):
+        for (cb, h), (out, dt) in zip(todo, result):
+            report[cb.name]["time"] += dt
+            changed |= storeResult(cb, key, h, out, getattrs, report)
+    for (cb, part), [(out, dt)] in zip(parts, results[len(single) :]):
+        report[cb.name]["time"] += dt
+        for key, h, _ in part:
+            res = out if isinstance(out, Exception) else out.get(key, {})
+            changed |= storeResult(cb, key, h, res, getattrs, report)
+    return changed
+
+
+def storeResult(cb, key, h, out, getattrs, report):
+    # out: the outputs of a dataset, or the exception of its calculation
+    if isinstance(out, Exception):
+        report[cb.name]["errors"][key] = out
+        return set()
+    attrs = getattrs(key)
+    attrs.update(out)
+    attrs[cb.cachekey] = h
+    report[cb.name]["calculated"] += 1
+    return {key}
+
+
+def frameHash(df):
+    # content hash of a frame: its index, columns and values
+    h = hashlib.sha1(repr(list(df.columns)).encode())
+    h.update(repr([str(x) for x in df.dtypes]).encode())
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        # cells that cannot be hashed, ie lists
+        h.update(pickle.dumps(df))
+    return h.hexdigest()
+
+
+def runCalcs(fns, df):
+    # runs in the worker processes of runCalcBatch. df is a dict of frames for batch
+    # callbacks. returns (outputs or exception, runtime) per callback
+    results = []
+    for fn in fns:
+        t0 = time.perf_counter()
         try:
-            cb(dfs)
-        except:  # noqa: E722
-            pass
+            out = dict(fn(df))
+        except Exception as e:
+            out = e
+        results.append((out, time.perf_counter() - t0))
+    return results
+
+
+def characteristicsCallback(col="y", target=1.0, names=None, prefix="out_"):
+    # registers a batch calc callback (see addCalcCallback) that adds the step
+    # response characteristics of col to the metadata of every dataset. col is its
+    # input, so the results are cached per dataset, and only the datasets that are
+    # not cached are calculated, all at once. returns the CalcCallback
+    names = tuple(STEPCHARACTERISTICS if names is None else names)
+    fn = Characteristics(col, target, names, prefix)
+    outputs = [prefix + x for x in names]
+    name = f"characteristics_{prefix}{col}_{target:g}"
+    return addCalcCallback(fn, [col], outputs, name=name, batch=True)
+
+
+class Characteristics:
+    # the batch function of characteristicsCallback. it is a class, so it can be
+    # sent to the worker processes of runCalcBatch
+    def __init__(self, col, target, names, prefix):
+        self.col = col
+        self.target = target
+        self.names = names
+        self.prefix = prefix
+
+    def __call__(self, dfs):
+        return addCharacteristics(dfs, self.col, self.target, self.names, self.prefix)
+
+
+def addCharacteristics(dfs, col="y", target=1.0, names=None, prefix="out_"):
+    # computes the characteristics of col for all datasets at once, and writes them
+    # into their attrs. datasets without col or without rows are skipped.
+    # returns a dict key -> characteristics
+    if isinstance(dfs, RaggedData):
+        if col not in dfs.columns:
+            return {}
+        x, y, offsets = dfs.x, dfs.y[:, dfs.columns.get_loc(col)], dfs.offsets
+        # col is all NaN in the series whose frame did not have it
+        lengths = np.diff(offsets)
+        keep = lengths > 0
+        if keep.any():
+            keep[keep] = ~np.logical_and.reduceat(np.isnan(y), offsets[:-1][keep])
+        keys = [k for k, ok in zip(dfs, keep) if ok]
+        if not keys:
+            return {}
+        if not keep.all():
+            rows = np.repeat(keep, lengths)
+            x, y = x[rows], y[rows]
+            offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths[keep])
+    else:
+        keys, xs, ys = [], [], []
+        for key, df in dfs.items():
+            if col in df.columns and len(df):
+                keys.append(key)
+                xs.append(df.index.values)
+                ys.append(df[col].values)
+        if not keys:
+            return {}
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(x) for x in xs])
+        x, y = np.concatenate(xs), np.concatenate(ys)
+
+    results = stepCharacteristics(x, y, offsets, target, names)
+    getattrs = getattr(dfs, "getattrs", lambda key: dfs[key].attrs)
+    rows = zip(*(x.tolist() for x in results.values()))
+    names = [prefix + x for x in results]
+    dct = dict((key, dict(zip(names, row))) for key, row in zip(keys, rows))
+    for key, out in dct.items():
+        getattrs(key).update(out)
+    return dct
+
+
+def stepCharacteristics(x, y, offsets, target=1.0, names=None, band=0.05):
+    # characteristics of ragged series: the rows of series n are
+    # offsets[n]:offsets[n+1] of x and y, no series may be empty.
+    # returns a dict name -> array with one value per series, for the names given
+    # (all of STEPCHARACTERISTICS by default):
+    # - os: overshoot over target, tr: rise time (first x above (1-band)*target)
+    # - tm: settling time (last x outside of target*(1 +- band), -10 if the series
+    #   does not settle), tp: peak time, ess: steady state error at the last sample
+    # - rms: root mean square of y, iae/ise/itae: integral of the absolute/squared/
+    #   time weighted absolute error
+    names = STEPCHARACTERISTICS if names is None else names
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    starts = np.asarray(offsets[:-1])
+    ends = np.asarray(offsets[1:])
+    lengths = ends - starts
+    seg = np.repeat(np.arange(len(starts)), lengths)
+    pos = np.arange(len(y))
+
+    def first(cond):
+        # position of the first true value per series, the start if there is none
+        found = np.minimum.reduceat(np.where(cond, pos, len(y)), starts)
+        return np.where(found < len(y), found, starts)
+
+    def integral(vals):
+        # trapezoidal integral per series, pairs across two series are left out
+        parts = np.diff(x) * (vals[1:] + vals[:-1]) / 2
+        parts[ends[:-1] - 1] = 0
+        return np.add.reduceat(np.append(parts, 0), starts)
+
+    res = {}
+    ymax = np.maximum.reduceat(y, starts)
+    err = target - y
+    if "os" in names:
+        res["os"] = np.maximum(0, ymax - target)
+    if "tr" in names:
+        res["tr"] = x[first(y > (1 - band) * target)]
+    if "tm" in names:
+        inside = (y > (1 - band) * target) & (y < (1 + band) * target)
+        last = np.maximum.reduceat(np.where(inside, -1, pos), starts)
+        settled = (last >= 0) & (last != ends - 1)
+        res["tm"] = np.where(settled, x[np.maximum(last, 0)], -10)
+    if "tp" in names:
+        res["tp"] = x[first(y == ymax[seg])]
+    if "ess" in names:
+        res["ess"] = err[ends - 1]
+    if "rms" in names:
+        res["rms"] = np.sqrt(np.add.reduceat(y ** 2, starts) / lengths)
+    if "iae" in names:
+        res["iae"] = integral(abs(err))
+    if "ise" in names:
+        res["ise"] = integral(err ** 2)
+    if "itae" in names:
+        res["itae"] = integral(x * abs(err))
+    return res
+
+
+def resampleSeries(x, y, offsets, grid):
+    # linear interpolation of ragged series (see stepCharacteristics) onto a common
+    # grid, for all series at once. the x of every series must be ascending.
+    # returns an array (series, grid), that is NaN outside of the x range of a series
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    starts = np.asarray(offsets[:-1])[:, None]
+    ends = np.asarray(offsets[1:])[:, None]
+    if not len(starts) or not len(x):
+        return np.full((len(starts), len(grid)), np.nan)
+    # every series is shifted by its number times a span larger than all x, so the
+    # concatenated x is ascending and one searchsorted finds all grid positions
+    span = 2 * (x.max() - x.min()) + 1
+    seg = np.repeat(np.arange(len(starts)), np.diff(offsets))
+    shifted = x - x.min() + seg * span
+    query = grid - x.min() + np.arange(len(starts))[:, None] * span
+    pos = np.searchsorted(shifted, query, side="right")
+    left = np.clip(pos - 1, starts, np.maximum(ends - 1, starts))
+    right = np.minimum(left + 1, np.maximum(ends - 1, starts))
+    dx = x[right] - x[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(dx > 0, (grid - x[left]) / dx, 0)
+    res = y[left] + w * (y[right] - y[left])
+    outside = (grid < x[np.minimum(starts, len(x) - 1)]) | (grid > x[ends - 1])
+    res[outside | (ends == starts)] = np.nan
+    return res
+
+
+def percentileBands(values, percentiles):
+    # percentiles (0..100, linear like np.percentile) over the rows of values, for
+    # every column. NaNs are left out, columns without values are NaN.
+    # returns an array (percentiles, columns)
+    q = np.asarray(percentiles, dtype=float) / 100
+    if not len(values):
+        return np.full((len(q), values.shape[1]), np.nan)
+    srt = np.sort(values, axis=0)
+    n = np.sum(~np.isnan(values), axis=0)
+    last = np.maximum(n - 1, 0)
+    pos = np.multiply.outer(q, last)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, last)
+    cols = np.arange(values.shape[1])
+    frac = pos - lo
+    res = srt[lo, cols] * (1 - frac) + srt[hi, cols] * frac
+    res[:, n == 0] = np.nan
+    return res
 
 
 # implements: e3
-def dict2h5(dct, file):
-    with pd.HDFStore(file) as store:
-        for key, df in dct.items():
-            store.put(key, df)
-            store.get_storer(key).attrs.metadata = df.attrs
+def dict2h5(dct, file, **kwargs):
+    # see iter2h5 for the kwargs
+    iter2h5(dct.items(), file, **kwargs)
+
+
+def iter2h5(
+    items,
+    file,
+    mode="a",
+    resume=False,
+    complevel=0,
+    complib=None,
+    format="fixed",
+    chunksize=None,
+    flushevery=FLUSHEVERY,
+):
+    # writes (key, df) pairs one after another, so only one frame is in memory.
+    # - mode="a" adds to (or replaces keys of) an existing store, "w" truncates it
+    # - resume=True skips keys that are already in the store, ie to continue an
+    #   interrupted write with the same items. a key whose write was interrupted is
+    #   written again
+    # - complevel/complib (ie "blosc", "blosc:lz4", "zlib") set the compression
+    # - with format="table", frames are written in chunks of chunksize rows
+    # - the store is flushed every flushevery keys, the metadata index is written
+    #   once at the end
+    with pd.HDFStore(file, mode=mode, complevel=complevel, complib=complib) as store:
+        root = store._handle.root._v_attrs
+        oldindex = readMetaIndex(store)
+        existing = dict.fromkeys(dataKeys(store))
+        # a key whose write was interrupted may be incomplete
+        pending = getattr(root, "parcoords_pending", None)
+        if pending is not None and pending in existing:
+            store.remove(pending)
+            del existing[pending]
+        bumpGeneration(store)
+
+        metadata = {}
+        for idx, (key, df) in enumerate(items):
+            key = "/" + key.lstrip("/")
+            if resume and key in existing:
+                continue
+            root.parcoords_pending = key
+            if format == "table" and not df.empty:
+                if key in store:
+                    store.remove(key)
+                store.append(key, df, format="table", chunksize=chunksize, index=False)
+            else:
+                store.put(key, df)
+            # a content hash that came with the attrs may be stale, see runCalcStage
+            attrs = dict((k, v) for k, v in df.attrs.items() if k != DATAHASH)
+            store.get_storer(key).attrs.metadata = attrs
+            existing.pop(key, None)
+            if not df.empty:
+                metadata[key] = attrs
+            if (idx + 1) % flushevery == 0:
+                store.flush()
+        if "parcoords_pending" in root:
+            del root.parcoords_pending
+
+        # keys that were not written now keep their metadata from the old index
+        if oldindex is not None:
+            old = oldindex.reindex([x for x in oldindex.index if x in existing])
+            missing = [x for x in existing if x not in oldindex.index]
+        else:
+            old = None
+            missing = list(existing)
+        frames = [metaFrame(walkMetaData(store, missing))] if missing else []
+        frames += [old] if old is not None and len(old) else []
+        frames.append(metaFrame(metadata))
+        writeMetaIndex(store, pd.concat(frames) if len(frames) > 1 else frames[0])
+    stampIndex(file)
+
+
+def upgrade(path):
+    # (re)writes the metadata index of a store that was written without it.
+    # path may also be a directory or a glob, see read
+    files = [path] if Path(path).is_file() else findFiles(path)[0]
+    for file in files:
+        with pd.HDFStore(file) as store:
+            writeMetaIndex(store)
+        stampIndex(file)
+
+
+def isDataKey(key):
+    return not key.startswith(METAKEY)
+
+
+def dataKeys(store):
+    return [x for x in store.keys() if isDataKey(x)]
+
+
+def walkMetaData(store, keys=None, subsample=1):
+    metadata = {}
+    if keys is None:
+        keys = dataKeys(store)
+    for key in keys[::subsample]:
+        storer = store.get_storer(key)
+        if storerLength(storer) == 0:
+            continue
+        metadata[key] = getattr(storer.attrs, "metadata", {})
+    return metadata
+
+
+def metaFrame(metadata):
+    # columnar table of the metadata dicts, one row per key
+    frame = pd.DataFrame.from_dict(metadata, orient="index")
+    # keys without any metadata are dropped by from_dict
+    frame = frame.reindex(list(metadata))
+    frame.index.name = "key"
+    return frame
+
+
+def bumpGeneration(store):
+    # writers bump the generation of the store before they change any data. the
+    # index is tagged with the generation it was written for, so an index that is
+    # not rewritten after a change (or after an interrupted write) is stale.
+    root = store._handle.root
+    root._v_attrs.parcoords_generation = getGeneration(store) + 1
+
+
+def getGeneration(store):
+    return getattr(store._handle.root._v_attrs, "parcoords_generation", 0)
+
+
+def indexGroups(keys):
+    # the groups that hold the keys, ie / and /batch for /batch/d0
+    return sorted(set(["/"] + [x.rpartition("/")[0] or "/" for x in keys]))
+
+
+def nodeStamp(store, groups):
+    # hash of the names of the nodes in groups (without the index). other tools that
+    # add or remove runs dont bump the generation, but change this. it lists every
+    # node once, so it is only used if the file changed since the index was written
+    h = hashlib.sha1()
+    for path in groups:
+        group = store.get_node(path)
+        names = [] if group is None else sorted(group._v_children)
+        names = [x for x in names if path.rstrip("/") + "/" + x != METAKEY]
+        h.update("\n".join([path] + names + [""]).encode())
+    return h.hexdigest()
+
+
+def writeMetaIndex(store, metadata=None):
+    # metadata: dict key -> attrs, or a frame of them (see metaFrame). the writer
+    # calls stampIndex once it closed the store
+    if metadata is None:
+        metadata = walkMetaData(store)
+    if not isinstance(metadata, pd.DataFrame):
+        metadata = metaFrame(metadata)
+    with warnings.catch_warnings():
+        # object columns are pickled, that's fine for the index
+        warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+        store.put(METAKEY, metadata)
+    attrs = store.get_storer(METAKEY).attrs
+    attrs.generation = getGeneration(store)
+    attrs.groups = indexGroups(metadata.index)
+    attrs.nodes = nodeStamp(store, attrs.groups)
+
+
+def stampIndex(file):
+    # records the size and mtime of a closed file in its metadata index. as long as
+    # they match, readMetaIndex trusts the index without listing the nodes. the mtime
+    # is restored after the stamp is written, so the stamp does not change it
+    for _ in range(3):
+        stat = os.stat(file)
+        with pd.HDFStore(file, mode="a") as store:
+            if METAKEY not in store:
+                return
+            stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+            store.get_storer(METAKEY).attrs.filestamp = stamp
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        # the first stamp may grow the file, the next one overwrites it in place
+        if os.stat(file).st_size == stat.st_size:
+            return
+
+
+def readMetaIndex(store):
+    # returns the persisted metadata index, or None if it is missing or stale: if a
+    # writer of this module did not finish it, or the nodes of the store changed.
+    # runs that other tools replace under the same name are not detected
+    if METAKEY not in store:
+        return None
+    attrs = store.get_storer(METAKEY).attrs
+    if getattr(attrs, "generation", None) != getGeneration(store):
+        return None
+    stat = os.stat(store.filename)
+    stamp = getattr(attrs, "filestamp", None)
+    if stamp is None or list(stamp) != [stat.st_size, stat.st_mtime_ns]:
+        groups = getattr(attrs, "groups", None)
+        if groups is None or getattr(attrs, "nodes", None) != nodeStamp(store, groups):
+            return None
+    return store[METAKEY]
+
+
+# implements: e1
+class LazyDataDict(Mapping):
+    # read-only mapping key->dataframe on top of an open hdf5 store.
+    # only the metadata is read on open, series are loaded on first access and
+    # kept in a LRU cache that is bounded by the memory size of the dataframes.
+    # without a valid index and walk=False, the mapping starts empty and is marked
+    # as not complete. the keys are then added with addMetaData.
+    # all access to the store goes through lock, so it can be shared with a thread.
+    # with keepopen=False (see release), the store is only open during an access.
+    def __init__(
+        self, file, subsample=1, cachesize=CACHESIZE, mode="r", walk=True, index=None
+    ):
+        self.file = file
+        self.mode = mode
+        self.subsample = subsample
+        self.cachesize = cachesize
+        self.cache = OrderedDict()
+        self.cachedbytes = 0
+        self.lock = threading.RLock()
+        self.keepopen = True
+        self.stamp = sourceStamp(file)
+        self.store = pd.HDFStore(file, mode=mode)
+        # with a valid index, attrs dicts are only created for keys that are used.
+        # the index may also be passed in, if it was read somewhere else already
+        self.index = readMetaIndex(self.store) if index is None else index
+        self.complete = self.index is not None or walk
+        if self.index is None and not walk:
+            self.metadata = {}
+            self.keylist = ()
+        elif self.index is None:
+            log.info(f"no valid metadata index in {file}, reading all storers")
+            self.metadata = walkMetaData(self.store, subsample=subsample)
+            self.keylist = tuple(self.metadata)
+        else:
+            self.index = self.index.iloc[::subsample]
+            self.metadata = {}
+            self.keylist = tuple(self.index.index)
+
+    def __getitem__(self, key):
+        df = self.cache.get(key)
+        if df is not None:
+            self.cache.move_to_end(key)
+            return df
+        with self.opened() as store:
+            df = store[key]
+        # share the attrs dict, so changes done by calc callbacks survive eviction
+        df.attrs = self.getattrs(key)
+        self.metadata[key] = df.attrs
+        self.cache[key] = df
+        self.cachedbytes += df.memory_usage(index=True).sum()
+        self.evict()
+        return df
+
+    def select(self, key, start=None, stop=None):
+        # the rows [start, stop) of a series, without reading (or caching) the others
+        df = self.cache.get(key)
+        if df is not None:
+            return df.iloc[start:stop]
+        with self.opened() as store:
+            df = store.select(key, start=start, stop=stop)
+        df.attrs = self.getattrs(key)
+        return df
+
+    def getattrs(self, key):
+        attrs = self.metadata.get(key)
+        if attrs is None:
+            if self.index is None or key not in self.index.index:
+                raise KeyError(key)
+            attrs = self.metadata[key] = self.index.loc[key].dropna().to_dict()
+        return attrs
+
+    def addMetaData(self, metadata):
+        new = tuple(x for x in metadata if x not in self.metadata)
+        self.metadata.update(metadata)
+        self.keylist += new
+
+    def persistAttrs(self, keys):
+        # writes the attrs of keys back into the store and its metadata index, ie
+        # the results of calc callbacks. a read-only store is reopened for that
+        with self.lock:
+            if self.mode != "r":
+                self.writeAttrs(self.store, keys)
+                return
+            self.store.close()
+            try:
+                with pd.HDFStore(self.file, mode="a") as store:
+                    self.writeAttrs(store, keys)
+                stampIndex(self.file)
+            finally:
+                if self.keepopen:
+                    self.store = pd.HDFStore(self.file, mode="r")
+                # our own changes are no reason for a refresh
+                self.stamp = sourceStamp(self.file)
+
+    def refresh(self):
+        # reloads the metadata index if the file changed (ie more runs were written)
+        # and returns the keys that were added, changed and removed, by comparing the
+        # index with the current metadata. only the attrs and frames of changed keys
+        # are dropped. returns None if the file did not change, or if it is being
+        # written (or cannot be opened) right now, so it should be tried again later.
+        # the file is opened again for every refresh. keys that other tools add or
+        # remove make the index stale, the metadata is walked then (see
+        # readMetaIndex). changes of the series that do not change their metadata
+        # are not detected
+        stamp = sourceStamp(self.file)
+        if stamp == self.stamp or not self.complete:
+            return None
+        with self.lock:
+            try:
+                store = pd.HDFStore(self.file, mode="r")
+            except Exception as e:
+                log.debug(f"could not reopen {self.file}: {e}")
+                return None
+            try:
+                if "parcoords_pending" in store._handle.root._v_attrs:
+                    store.close()
+                    return None
+                new = readMetaIndex(store)
+                if new is None:
+                    new = metaFrame(walkMetaData(store))
+            except Exception as e:
+                log.debug(f"could not read the metadata of {self.file}: {e}")
+                store.close()
+                return None
+            new = new.iloc[:: self.subsample]
+            old = self.currentMetaFrame()
+            self.store.close()
+            self.store = store
+            if not self.keepopen:
+                store.close()
+
+        oldkeys = set(old.index)
+        newkeys = set(new.index)
+        added = [x for x in new.index if x not in oldkeys]
+        removed = [x for x in old.index if x not in newkeys]
+        common = [x for x in new.index if x in oldkeys]
+        # only the columns of the file are compared, calc results may not be in it
+        a = old.reindex(index=common, columns=new.columns)
+        b = new.reindex(index=common)
+        same = (a.values == b.values) | (a.isna().values & b.isna().values)
+        changed = [x for x, row in zip(common, same) if not row.all()]
+
+        for key in changed + removed:
+            self.metadata.pop(key, None)
+            df = self.cache.pop(key, None)
+            if df is not None:
+                self.cachedbytes -= df.memory_usage(index=True).sum()
+        self.index = new
+        self.keylist = tuple(new.index)
+        self.stamp = stamp
+        return added, changed, removed
+
+    def currentMetaFrame(self):
+        if self.index is None:
+            return metaFrame(self.metadata)
+        if not self.metadata:
+            return self.index
+        touched = metaFrame(self.metadata)
+        return touched.combine_first(self.index).reindex(self.index.index)
+
+    def writeAttrs(self, store, keys):
+        full = readMetaIndex(store)
+        bumpGeneration(store)
+        for key in keys:
+            store.get_storer(key).attrs.metadata = self.metadata[key]
+        if full is None:
+            writeMetaIndex(store)
+        else:
+            touched = metaFrame(dict((k, self.metadata[k]) for k in keys))
+            writeMetaIndex(store, touched.combine_first(full).reindex(full.index))
+
+    def evict(self):
+        # always keep the most recently used frame, even if it is too large
+        while self.cachedbytes > self.cachesize and len(self.cache) > 1:
+            _, df = self.cache.popitem(last=False)
+            self.cachedbytes -= df.memory_usage(index=True).sum()
+
+    def __iter__(self):
+        return iter(self.keylist)
+
+    def __len__(self):
+        return len(self.keylist)
+
+    def __contains__(self, key):
+        if self.index is None:
+            return key in self.metadata
+        return key in self.index.index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextmanager
+    def opened(self):
+        # the store, under the lock. it is reopened if it was released
+        with self.lock:
+            if not self.store.is_open:
+                self.store = pd.HDFStore(self.file, mode=self.mode)
+            try:
+                yield self.store
+            finally:
+                if not self.keepopen:
+                    self.store.close()
+
+    def release(self):
+        # closes the store between accesses, so no handle is kept open while other
+        # processes write the file (ie in watch mode)
+        with self.lock:
+            self.keepopen = False
+            self.store.close()
+
+    def get_storer(self, key):
+        # the storer can only be used while the store is open, see keepopen
+        with self.lock:
+            if not self.store.is_open:
+                self.store = pd.HDFStore(self.file, mode=self.mode)
+            return self.store.get_storer(key)
+
+    def close(self):
+        self.cache.clear()
+        self.cachedbytes = 0
+        with self.lock:
+            self.store.close()
+
+
+class MultiDataDict(Mapping):
+    # read-only mapping over the LazyDataDicts of several files. the keys are
+    # namespaced with the path of their file relative to root, eg /batch01/d0.
+    # the metadata of the files is read in a process pool with OPENWORKERS processes,
+    # from the index if the file has a valid one. files that fail to load are logged
+    # and kept in errors (file -> exception), the others are loaded anyway.
+    complete = True
+
+    def __init__(self, files, root=None, subsample=1, workers=OPENWORKERS):
+        self.files = {}
+        self.errors = {}
+        files = [Path(x) for x in files]
+        if root is None:
+            root = Path(os.path.commonpath([x.parent for x in files]))
+
+        indices = {}
+        if workers > 1 and len(files) > 1:
+            with ProcessPoolExecutor(min(workers, len(files))) as pool:
+                futures = [(x, pool.submit(readFileIndex, x)) for x in files]
+                for file, future in futures:
+                    try:
+                        indices[file] = future.result()
+                    except Exception as e:
+                        self.addError(file, e)
+        else:
+            for file in files:
+                try:
+                    indices[file] = readFileIndex(file)
+                except Exception as e:
+                    self.addError(file, e)
+
+        self.keylist = ()
+        for file, index in indices.items():
+            prefix = "/" + file.relative_to(root).with_suffix("").as_posix()
+            try:
+                data = LazyDataDict(file, subsample=subsample, index=index)
+            except Exception as e:
+                self.addError(file, e)
+                continue
+            self.files[prefix] = data
+            self.keylist += tuple(prefix + x for x in data)
+
+    def addError(self, file, e):
+        log.warning(f"could not load {file}: {e}")
+        self.errors[file] = e
+
+    def split(self, key):
+        prefix, _, subkey = key.rpartition("/")
+        while prefix and prefix not in self.files:
+            prefix, _, rest = prefix.rpartition("/")
+            subkey = rest + "/" + subkey
+        if not prefix:
+            raise KeyError(key)
+        return self.files[prefix], "/" + subkey
+
+    def __getitem__(self, key):
+        data, subkey = self.split(key)
+        return data[subkey]
 
+    def select(self, key, start=None, stop=None):
+        data, subkey = self.split(key)
+        return data.select(subkey, start, stop)
 
-def h52dict(file, subsample=1):
+    def getattrs(self, key):
+        data, subkey = self.split(key)
+        return data.getattrs(subkey)
+
+    def refresh(self):
+        # see LazyDataDict.refresh, files that are added to a directory source are
+        # not detected
+        diffs = []
+        for prefix, data in self.files.items():
+            diff = data.refresh()
+            if diff is not None:
+                diffs.append([[prefix + x for x in keys] for keys in diff])
+        if not diffs:
+            return None
+        self.keylist = tuple(p + x for p, data in self.files.items() for x in data)
+        return tuple(sum(x, []) for x in zip(*diffs))
+
+    def persistAttrs(self, keys):
+        subkeys = {}
+        for key in keys:
+            data, subkey = self.split(key)
+            subkeys.setdefault(data, []).append(subkey)
+        for data, keys in subkeys.items():
+            data.persistAttrs(keys)
+
+    def release(self):
+        for data in self.files.values():
+            data.release()
+
+    def get_storer(self, key):
+        data, subkey = self.split(key)
+        return data.get_storer(subkey)
+
+    def __iter__(self):
+        return iter(self.keylist)
+
+    def __len__(self):
+        return len(self.keylist)
+
+    def __contains__(self, key):
+        try:
+            data, subkey = self.split(key)
+        except KeyError:
+            return False
+        return subkey in data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for data in self.files.values():
+            data.close()
+
+
+class RaggedData(Mapping):
+    # all series of a source in contiguous buffers. x holds the index values of all
+    # keys, y the columns (shared by all keys) as a 2d array. the rows of key n
+    # are offsets[n]:offsets[n+1]. dataframes are only created on access, as views
+    # into the buffers. calc callbacks and plots can use the buffers directly, see
+    # series and reduce.
+    complete = True
+
+    def __init__(self, keys, offsets, x, y, columns, metadata, indexname=None):
+        self.keylist = tuple(keys)
+        self.keypos = dict((k, idx) for idx, k in enumerate(self.keylist))
+        self.offsets = offsets
+        self.x = x
+        self.y = y
+        self.columns = pd.Index(columns)
+        self.metadata = metadata
+        self.indexname = indexname
+
+    @classmethod
+    def fromFrames(cls, dfs, dtype=None):
+        # columns that are missing in a frame are NaN there, columns that are no
+        # numbers are dropped. a first pass collects the lengths and columns (from
+        # the storers of lazy sources, see frameLayout), then the buffers are
+        # allocated once and filled frame by frame, without keeping the frames
+        keys = list(dfs)
+        lengths, columns = [], {}
+        for key in keys:
+            length, dtypes = frameLayout(dfs, key)
+            lengths.append(length)
+            for col, coltype in dtypes:
+                if col not in columns:
+                    columns[col] = np.dtype(coltype).kind in "biuf"
+        for col in (x for x, usable in columns.items() if not usable):
+            log.warning(f"column {col} is not numeric, it is not packed")
+        columns = [x for x, usable in columns.items() if usable]
+        colpos = dict((col, idx) for idx, col in enumerate(columns))
+
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        # column major, so every column is contiguous
+        y = np.empty((offsets[-1], len(columns)), dtype=dtype or float, order="F")
+        x = None
+        getattrs = getattr(dfs, "getattrs", None)
+        select = getattr(dfs, "select", dfs.__getitem__)
+        metadata, indexname = {}, None
+        for key, start, stop in zip(keys, offsets[:-1], offsets[1:]):
+            df = select(key)
+            if len(df) != stop - start:
+                raise ValueError(f"{key} has {len(df)} rows, expected {stop - start}")
+            # the index dtype is only known from the frames, it is widened if needed
+            vals = df.index.values
+            if x is None:
+                x = np.empty(offsets[-1], dtype=vals.dtype)
+            elif np.result_type(x.dtype, vals.dtype) != x.dtype:
+                x = x.astype(np.result_type(x.dtype, vals.dtype))
+            x[start:stop] = vals
+            y[start:stop] = np.nan
+            for col in df.columns:
+                if col in colpos:
+                    y[start:stop, colpos[col]] = df[col].values
+            metadata[key] = df.attrs if getattrs is None else getattrs(key)
+            indexname = df.index.name
+            del df
+        x = np.zeros(0) if x is None else x
+        return cls(keys, offsets, x, y, columns, metadata, indexname)
+
+    def slice(self, key):
+        pos = self.keypos[key]
+        return slice(self.offsets[pos], self.offsets[pos + 1])
+
+    def series(self, key, col):
+        # x, y of one column of a key, as views into the buffers
+        rows = self.slice(key)
+        return self.x[rows], self.y[rows, self.columns.get_loc(col)]
+
+    def reduce(self, ufunc, col):
+        # ufunc (ie np.maximum) over the rows of every key, without creating frames
+        vals = self.y[:, self.columns.get_loc(col)]
+        return ufunc.reduceat(vals, self.offsets[:-1])
+
+    def __getitem__(self, key):
+        rows = self.slice(key)
+        index = pd.Index(self.x[rows], name=self.indexname)
+        df = pd.DataFrame(self.y[rows], index=index, columns=self.columns)
+        df.attrs = self.metadata[key]
+        return df
+
+    def getattrs(self, key):
+        return self.metadata[key]
+
+    def __iter__(self):
+        return iter(self.keylist)
+
+    def __len__(self):
+        return len(self.keylist)
+
+    def __contains__(self, key):
+        return key in self.keypos
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class SubsetData(Mapping):
+    # some keys of another mapping (ie the result of query). the series and the
+    # metadata are read from it on access. with owned=True, closing the subset
+    # closes the other mapping.
+    complete = True
+
+    def __init__(self, data, keys, owned=False):
+        self.data = data
+        self.keylist = tuple(keys)
+        self.keyset = set(self.keylist)
+        self.owned = owned
+
+    def __getitem__(self, key):
+        if key not in self.keyset:
+            raise KeyError(key)
+        return self.data[key]
+
+    def select(self, key, start=None, stop=None):
+        if key not in self.keyset:
+            raise KeyError(key)
+        if hasattr(self.data, "select"):
+            return self.data.select(key, start, stop)
+        return self.data[key].iloc[start:stop]
+
+    def getattrs(self, key):
+        if key not in self.keyset:
+            raise KeyError(key)
+        getattrs = getattr(self.data, "getattrs", lambda key: self.data[key].attrs)
+        return getattrs(key)
+
+    def persistAttrs(self, keys):
+        if hasattr(self.data, "persistAttrs"):
+            self.data.persistAttrs(keys)
+
+    def get_storer(self, key):
+        # None if the other mapping does not store its series (ie a RaggedData)
+        if key not in self.keyset:
+            raise KeyError(key)
+        getstorer = getattr(self.data, "get_storer", None)
+        return None if getstorer is None else getstorer(key)
+
+    def __iter__(self):
+        return iter(self.keylist)
+
+    def __len__(self):
+        return len(self.keylist)
+
+    def __contains__(self, key):
+        return key in self.keyset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.owned:
+            self.data.close()
+
+
+def readFileIndex(file):
+    # metadata index of a file. files without a valid index are walked instead,
+    # this runs in the worker processes of MultiDataDict
+    with pd.HDFStore(file, mode="r") as store:
+        index = readMetaIndex(store)
+        if index is None:
+            index = metaFrame(walkMetaData(store))
+    return index
+
+
+def storerLength(storer):
+    # number of rows of a stored frame, read from the node shapes only
+    if getattr(storer, "nrows", None) is not None:
+        return storer.nrows
+    for name in ("axis1", "index"):
+        if name in storer.group:
+            node = storer.group._f_get_child(name)
+            # pandas stores empty arrays as placeholders and keeps the real shape
+            return getattr(node._v_attrs, "shape", node.shape)[0]
+    return 1
+
+
+def storerColumns(storer):
+    # (column, dtype) of a stored frame, read from the nodes only. None for storers
+    # that are no plain fixed format frames
+    if storer.is_table or storer.pandas_type != "frame":
+        return None
+    if getattr(storer.attrs, "axis0_variety", None) != "regular":
+        return None
+    dtypes = {}
+    for idx in range(storer.nblocks):
+        node = storer.group._f_get_child(f"block{idx}_values")
+        # datetimes and objects (stored as pickled VLArray) are no numbers
+        if getattr(node._v_attrs, "value_type", None) or not hasattr(node, "dtype"):
+            coltype = np.dtype(object)
+        else:
+            coltype = node.dtype
+        for col in storer.read_index(f"block{idx}_items"):
+            dtypes[col] = coltype
+    return [(col, dtypes[col]) for col in storer.read_index("axis0")]
+
+
+def frameLayout(dfs, key):
+    # length and (column, dtype) of a frame. for stored series, these are read
+    # from the storer (or the first row), not from the whole frame
+    storer = dfs.get_storer(key) if hasattr(dfs, "get_storer") else None
+    if storer is None:
+        df = dfs[key]
+        return len(df), list(df.dtypes.items())
+    dtypes = storerColumns(storer)
+    if dtypes is None:
+        dtypes = list(dfs.select(key, 0, 0).dtypes.items())
+    return storerLength(storer), dtypes
+
+
+def getMetaData(data):
+    # metadata of all datasets, without loading the series if possible
+    if isinstance(data, (LazyDataDict, MultiDataDict, RaggedData, SubsetData)):
+        return dict((k, data.getattrs(k)) for k in data)
+    return dict((k, v.attrs) for k, v in data.items())
+
+
+def h52dict(file, subsample=1, progress=None, workers=None):
+    # progress(done, total) is called every 100 keys (or chunk of keys, if parallel)
+    workers = workers or READWORKERS
+    if workers > 1:
+        return h52dictParallel(file, subsample, progress, workers)
     dct = {}
-    with pd.HDFStore(file) as store:
-        keys = list(store.keys()[::subsample])
+    with pd.HDFStore(file, mode="r") as store:
+        keys = dataKeys(store)[::subsample]
         L = len(keys)
         for idx, key in enumerate(keys):
-            if idx % 100 == 0:
-                print(f"loading key {idx+1}/{L}")
+            if progress is not None and idx % 100 == 0:
+                progress(idx, L)
             df = store[key]
             if df.empty:
                 continue
@@ -61,30 +1363,450 @@ def h52dict(file, subsample=1):
     return dct
 
 
+def h52dictParallel(file, subsample=1, progress=None, workers=2):
+    # the keys are split into contiguous chunks that are read by a process pool.
+    # every worker opens its own read-only handle and sends the arrays of a chunk back
+    # in one shared memory block, only the layout is pickled. the chunks are collected
+    # in key order, so the result is the same as the one of the serial path.
+    with pd.HDFStore(file, mode="r") as store:
+        keys = dataKeys(store)[::subsample]
+    L = len(keys)
+    size = max(1, -(-L // (workers * READCHUNKS)))
+    chunks = [keys[x : x + size] for x in range(0, L, size)]
+
+    dct = {}
+    done = 0
+    # the workers have to share our tracker, otherwise theirs would remove the
+    # shared memory blocks they created when they exit
+    if SHMBLOCKS:
+        resource_tracker.ensure_running()
+    with ProcessPoolExecutor(workers) as pool:
+        pending = [pool.submit(readChunk, file, x) for x in chunks]
+        try:
+            for chunk in chunks:
+                packed = pending[0].result()
+                pending.pop(0)
+                dct.update(unpackFrames(*packed))
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, L)
+        finally:
+            # if a chunk failed, the blocks of the chunks that were already read
+            # are not unpacked, and have to be removed here
+            pool.shutdown(cancel_futures=True)
+            for future in pending:
+                if not future.cancelled() and future.exception() is None:
+                    discardChunk(future.result()[0])
+    return dct
+
+
+def discardChunk(name):
+    if name is not None:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+
+
+def readChunk(file, keys):
+    frames = []
+    with pd.HDFStore(file, mode="r") as store:
+        for key in keys:
+            df = store[key]
+            if df.empty:
+                continue
+            frames.append((key, df, store.get_storer(key).attrs.metadata))
+    return packFrames(frames)
+
+
+def packFrames(frames):
+    # returns the name of a shared memory block that holds all numeric arrays of the
+    # frames, and the layout to restore them. arrays of other types (ie tz-aware or
+    # categorical ones, and frames with multiindexes or duplicate columns) are kept in
+    # the layout and pickled, as are all arrays without SHMBLOCKS.
+    layout = []
+    arrays = []
+    nbytes = 0
+    for key, df, attrs in frames:
+        if (
+            isinstance(df.index, pd.MultiIndex)
+            or isinstance(df.columns, pd.MultiIndex)
+            or not df.columns.is_unique
+        ):
+            layout.append((key, attrs, df))
+            continue
+        specs = []
+        for arr in [df.index.array] + [df[x].array for x in df.columns]:
+            if (
+                SHMBLOCKS
+                and isinstance(arr.dtype, np.dtype)
+                and arr.dtype.kind in SHMTYPES
+            ):
+                arr = np.ascontiguousarray(arr.to_numpy())
+                specs.append((arr.dtype.str, arr.shape, nbytes))
+                arrays.append((arr, nbytes))
+                nbytes += -(-arr.nbytes // 8) * 8
+            else:
+                specs.append(arr)
+        layout.append((key, attrs, (df.index.name, list(df.columns), specs)))
+    if not arrays:
+        return None, layout
+
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    for arr, offset in arrays:
+        dst = np.ndarray(arr.shape, arr.dtype, buffer=shm.buf, offset=offset)
+        dst[...] = arr
+        del dst
+    shm.close()
+    return shm.name, layout
+
+
+def unpackFrames(name, layout):
+    shm = None if name is None else shared_memory.SharedMemory(name=name)
+    try:
+        dct = {}
+        for key, attrs, frame in layout:
+            if not isinstance(frame, pd.DataFrame):
+                indexname, columns, specs = frame
+                arrs = []
+                for spec in specs:
+                    if isinstance(spec, tuple):
+                        dtype, shape, offset = spec
+                        view = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+                        spec = view.copy()
+                        del view
+                    arrs.append(spec)
+                index = pd.Index(arrs[0], name=indexname)
+                frame = pd.DataFrame(dict(zip(columns, arrs[1:])), index=index)
+            frame.attrs = attrs
+            dct[key] = frame
+        return dct
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+def cachePath(file):
+    return Path(str(file) + CACHESUFFIX)
+
+
+def sourceStamp(file):
+    # caches are invalidated when the size or modification time of the source changes
+    stat = os.stat(file)
+    return (CACHEVERSION, stat.st_size, stat.st_mtime_ns)
+
+
+def dict2cache(dct, folder, source=None):
+    # writes the series of dct as raw buffers into folder: x.bin (the index values),
+    # y.bin (all columns, column after column) and offsets.bin, plus a table with the
+    # keys, columns, dtypes and attrs. cache2dict maps them with np.memmap.
+    # source is the file the data was read from, its stamp is kept in the table
+    if not isinstance(dct, RaggedData):
+        dct = RaggedData.fromFrames(dct)
+    folder = Path(folder)
+    tmp = folder.with_name(folder.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, arr in (("x", dct.x), ("y", dct.y), ("offsets", dct.offsets)):
+        arr.ravel(order="F" if name == "y" else "C").tofile(tmp / f"{name}.bin")
+    table = dict(
+        keys=dct.keylist,
+        columns=list(dct.columns),
+        indexname=dct.indexname,
+        metadata=dct.metadata,
+        shapes=dict(x=dct.x.shape, y=dct.y.shape, offsets=dct.offsets.shape),
+        dtypes=dict(
+            x=dct.x.dtype.str, y=dct.y.dtype.str, offsets=dct.offsets.dtype.str
+        ),
+        stamp=None if source is None else sourceStamp(source),
+    )
+    pd.to_pickle(table, tmp / "table.pkl")
+    # replace an old cache only once the new one is complete
+    shutil.rmtree(folder, ignore_errors=True)
+    tmp.rename(folder)
+
+
+def cache2dict(folder, source=None):
+    # returns a RaggedData on read-only memory maps of the buffers. returns None if
+    # there is no cache in folder, or if it was not written for the current source
+    folder = Path(folder)
+    try:
+        table = pd.read_pickle(folder / "table.pkl")
+    except (OSError, ValueError, EOFError):
+        return None
+    if source is not None and table["stamp"] != sourceStamp(source):
+        return None
+
+    arrs = {}
+    for name, shape in table["shapes"].items():
+        dtype = np.dtype(table["dtypes"][name])
+        order = "F" if name == "y" else "C"
+        if np.prod(shape) == 0:
+            arrs[name] = np.zeros(shape, dtype=dtype, order=order)
+            continue
+        arrs[name] = np.memmap(
+            folder / f"{name}.bin", dtype=dtype, mode="r", shape=shape, order=order
+        )
+    return RaggedData(
+        table["keys"],
+        arrs["offsets"],
+        arrs["x"],
+        arrs["y"],
+        table["columns"],
+        table["metadata"],
+        table["indexname"],
+    )
+
+
+def readCached(file, dtype=None, workers=None):
+    data = cache2dict(cachePath(file), file)
+    if data is not None and (dtype is None or data.y.dtype == dtype):
+        return data
+    log.info(f"building the cache of {file}")
+    if (workers or READWORKERS) > 1:
+        data = RaggedData.fromFrames(h52dict(file, workers=workers), dtype)
+    else:
+        with LazyDataDict(file) as src:
+            data = RaggedData.fromFrames(src, dtype)
+    try:
+        dict2cache(data, cachePath(file), file)
+    except OSError as e:
+        log.warning(f"could not write the cache of {file}: {e}")
+        return data
+    return cache2dict(cachePath(file), file)
+
+
 # implements: e4
 def getMetaMatrix(data, subkey=None):
-    rows = tuple(data.keys())
-    allMetaData = [data[x].attrs for x in rows]
-    cfi = itt.chain.from_iterable
+    if isinstance(data, LazyDataDict) and data.index is not None:
+        return indexedMetaMatrix(data)
+    if isinstance(data, MultiDataDict):
+        return multiMetaMatrix(data)
+    if isinstance(data, SubsetData):
+        # the rows of the full matrix, which may use the index of the source
+        meta = getMetaMatrix(data.data).loc[list(data.keylist)]
+        return meta.dropna(axis=1, how="all")
+    return metaMatrix(getMetaData(data))
 
-    def isUsableMetaKey(key):
-        try:
-            metadata = set(x.get(key, None) for x in allMetaData)
-            metadata.discard(None)
-            sorted(float(x) for x in metadata)
-        except:  # noqa: E722 # if set() or sorted() fail, assume the data is unusable
-            return False
-        return True
 
-    metaKeys = set(cfi(x.keys() for x in allMetaData))
-    metaKeys = (x for x in metaKeys if not x.startswith("_"))
-    metaKeys = sorted(x for x in metaKeys if isUsableMetaKey(x))
+def metaMatrix(metadata):
+    # the matrix of a mapping of key -> attrs dict
+    rows = tuple(metadata.keys())
+
+    # single pass over all attrs dicts. rows that share the same metadata keys
+    # (usually all of them) are grouped, so they can be converted as one block
+    schemas = {}
+    for row, attrs in enumerate(metadata.values()):
+        keys = tuple(attrs)
+        schema = schemas.get(keys)
+        if schema is None:
+            schema = schemas[keys] = ([], [])
+        schema[0].append(row)
+        schema[1].append(tuple(attrs.values()))
+
+    columns = {}
+    unusable = set()
+    for keys, (idx, vals) in schemas.items():
+        block = floatColumn(vals, ndim=2)
+        for colno, key in enumerate(keys):
+            if key in unusable or str(key).startswith("_"):
+                continue
+            if block is not None:
+                col = block[:, colno]
+            else:
+                col = floatColumn([x[colno] for x in vals])
+            if col is None:
+                unusable.add(key)
+                continue
+            columns.setdefault(key, []).append((idx, col))
+
+    dct = {}
+    for key in sorted(x for x in columns if x not in unusable):
+        dct[key] = np.full(len(rows), np.nan)
+        for idx, col in columns[key]:
+            dct[key][idx] = col
+
+    return pd.DataFrame(dct, index=pd.Index(rows, name="key"))
+
+
+def floatColumn(vals, ndim=1):
+    # converts the values of one metadata key (or a block of rows with ndim=2) at once.
+    # None and NaN mark missing values. returns None if the values are no numbers
+    try:
+        vals = np.asarray(vals, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if vals.ndim != ndim:
+        return None
+    return vals
+
+
+def indexedMetaMatrix(data):
+    # metadata map from the persisted index, in a single read.
+    # attrs that were handed out may have been changed by calc callbacks
+    frame = data.currentMetaFrame()
+
+    dct = {}
+    for key in sorted(x for x in frame.columns if not str(x).startswith("_")):
+        vals = floatColumn(frame[key].values)
+        if vals is not None:
+            dct[key] = vals
+    return pd.DataFrame(dct, index=frame.index)
+
+
+def multiMetaMatrix(data):
+    # the metadata maps of all files, stacked. columns that are missing in a file
+    # are NaN there
+    frames = []
+    for prefix, sub in data.files.items():
+        frame = getMetaMatrix(sub)
+        frame.index = prefix + frame.index
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="key"))
+    frame = pd.concat(frames)
+    frame.index.name = "key"
+    return frame[sorted(frame.columns)]
+
+
+class RangeFilter:
+    # selects the rows of a metadata matrix that lie within per-column limits.
+    # every column is sorted once, so the rows of a range are found by binary search.
+    # the result of each axis is kept as a packed bitmask and only recomputed when
+    # the limits of that axis change.
+    def __init__(self, meta):
+        self.meta = meta
+        self.keys = meta.index
+        self.sorted = {}
+        for col in meta.columns:
+            vals = meta[col].values
+            order = np.argsort(vals, kind="stable")
+            self.sorted[col] = (vals[order], order)
+        self.lims = {}
+        self.masks = {}
+        self.mask = np.ones(len(meta), dtype=bool)
+
+    def axisMask(self, col, minval, maxval):
+        vals, order = self.sorted[col]
+        start = np.searchsorted(vals, minval, side="left")
+        end = np.searchsorted(vals, maxval, side="right")
+        mask = np.zeros(len(vals), dtype=bool)
+        mask[order[start:end]] = True
+        return np.packbits(mask)
+
+    def select(self, lims):
+        # lims: dict col -> (min, max), columns that are not in lims are not filtered
+        lims = dict((k, tuple(v)) for k, v in lims.items())
+        if lims == self.lims:
+            return self.mask
+        for col in set(self.masks) - set(lims):
+            del self.masks[col]
+        for col, lim in lims.items():
+            if self.lims.get(col) != lim:
+                self.masks[col] = self.axisMask(col, *lim)
+        self.lims = lims
+
+        if self.masks:
+            packed = np.bitwise_and.reduce(list(self.masks.values()))
+            self.mask = np.unpackbits(packed, count=len(self.keys)).astype(bool)
+        else:
+            self.mask = np.ones(len(self.keys), dtype=bool)
+        return self.mask
+
+    def getKeys(self, lims):
+        return self.keys[self.select(lims)]
+
+
+class MetaStats:
+    # statistics of a selection of rows of a metadata matrix. every column is sorted
+    # once (the sorted columns of a RangeFilter can be reused) and each row is
+    # replaced by its rank, so min, max and median of a selection are found from its
+    # ranks in O(selection). NaNs are sorted last and left out. histograms use bins
+    # over the whole column, the bin of every row is precomputed.
+    def __init__(self, meta, sortedcols=None, bins=STATSBINS):
+        self.meta = meta
+        self.bins = bins
+        self.columns = {}
+        for col in meta.columns:
+            if sortedcols is not None and col in sortedcols:
+                vals, order = sortedcols[col]
+            else:
+                order = np.argsort(meta[col].values, kind="stable")
+                vals = meta[col].values[order]
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            nvalid = np.count_nonzero(~np.isnan(vals))
+            edges = np.histogram_bin_edges(vals[:nvalid] if nvalid else [0], bins)
+            binidx = np.searchsorted(edges, meta[col].values, side="right") - 1
+            binidx = np.clip(binidx, 0, bins - 1)
+            binidx[rank >= nvalid] = bins
+            self.columns[col] = (vals, rank, nvalid, edges, binidx)
+
+    def describe(self, col, rows):
+        # rows: positions in the matrix. returns count, min, max and median
+        vals, rank, nvalid, _, _ = self.columns[col]
+        ranks = rank[rows]
+        ranks = ranks[ranks < nvalid]
+        if not len(ranks):
+            return 0, np.nan, np.nan, np.nan
+        mid = [(len(ranks) - 1) // 2, len(ranks) // 2]
+        median = vals[np.partition(ranks, mid)[mid]].mean()
+        return len(ranks), vals[ranks.min()], vals[ranks.max()], median
+
+    def histogram(self, col, rows=None):
+        # counts of the rows (all by default) per bin, and the bin edges
+        _, _, _, edges, binidx = self.columns[col]
+        idx = binidx if rows is None else binidx[rows]
+        return np.bincount(idx, minlength=self.bins + 1)[: self.bins], edges
+
+
+class MinMaxPyramid:
+    # multi-resolution min/max envelopes of a series, for drawing it with a number of
+    # points that only depends on the available pixels. level n summarizes blocks of
+    # FACTOR**n samples by their min and max. the full resolution is not kept, when a
+    # range is zoomed in far enough, its rows [start, stop) are fetched with
+    # loader(start, stop).
+    FACTOR = 4
+
+    def __init__(self, x, y, loader=None, minblocks=1024):
+        if loader is None:
+            loader = lambda start, stop: (x[start:stop], y[start:stop])  # noqa: E731
+        self.loader = loader
+        self.size = len(x)
+        self.levels = []
+        xs = np.asarray(x)
+        ymin = ymax = np.asarray(y, dtype=float)
+        while len(xs) > minblocks:
+            starts = np.arange(0, len(xs), self.FACTOR)
+            xs = xs[starts]
+            ymin = np.fmin.reduceat(ymin, starts)
+            ymax = np.fmax.reduceat(ymax, starts)
+            self.levels.append((xs, ymin, ymax))
+
+    def get(self, xmin=None, xmax=None, npoints=2000):
+        # returns x, y of the range [xmin, xmax] with at most ~2*npoints points.
+        # the range is extended by one sample or block, so lines leave the view
+        if not self.levels:
+            x, y = self.loader(0, self.size)
+            start, end = self.slice(x, xmin, xmax)
+            return x[start:end], y[start:end]
+        start, end = self.slice(self.levels[0][0], xmin, xmax)
+        if (end - start) * self.FACTOR <= npoints:
+            # only the rows of the blocks of level 0 that are in the range
+            x, y = self.loader(start * self.FACTOR, min(end * self.FACTOR, self.size))
+            start, end = self.slice(x, xmin, xmax)
+            return x[start:end], y[start:end]
 
-    lst = [
-        [key] + [allMetaData[idx][y] for y in metaKeys] for idx, key in enumerate(rows)
-    ]
-    df = pd.DataFrame(lst)
-    df.columns = ["key"] + metaKeys
-    df.set_index("key", inplace=True)
+        # the finest level that fits, or the coarsest one
+        for x, ymin, ymax in self.levels:
+            start, end = self.slice(x, xmin, xmax)
+            if end - start <= npoints:
+                break
+        x, ymin, ymax = x[start:end], ymin[start:end], ymax[start:end]
+        return np.repeat(x, 2), np.column_stack((ymin, ymax)).ravel()
 
-    return df
+    @staticmethod
+    def slice(x, xmin, xmax):
+        start = 0 if xmin is None else max(0, np.searchsorted(x, xmin) - 1)
+        end = len(x) if xmax is None else np.searchsorted(x, xmax, side="right") + 1
+        return start, min(end, len(x))
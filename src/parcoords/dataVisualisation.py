@@ -1,28 +1,139 @@
+import base64
 import importlib
 import json
 import tempfile
+from collections import OrderedDict
 from pathlib import Path
 from typing import List
 
 import numpy as np
+import pandas as pd
+import plotly
 import plotly.colors as pcol
 import plotly.graph_objects as go
 import pyqtgraph as pg
+from plotly.offline import get_plotlyjs
+from plotly.utils import PlotlyJSONEncoder
 from pyqtgraph.dockarea.Dock import Dock
 from pyqtgraph.dockarea.DockArea import DockArea
 from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 from tabulate import tabulate
 
-from parcoords.dataAnalysis import getMetaMatrix
+from parcoords import log as logging
+from parcoords.dataAnalysis import (
+    MetaStats,
+    MinMaxPyramid,
+    RaggedData,
+    RangeFilter,
+    dataKeys,
+    doCalculations,
+    getMetaMatrix,
+    metaMatrix,
+    percentileBands,
+    resampleSeries,
+    walkMetaData,
+)
+
+log = logging.getLogger()
 
-QtWebEngineWidgets = importlib.import_module(pg.Qt.lib + ".QtWebEngineWidgets")
 DBG_DONTBLOCK = False
+PARCOORDBACKEND = "web"  # "web" (plotly) or "native" (pyqtgraph)
+BRUSHDEBOUNCE = 50  # ms to wait for more brush events before filtering
+PACKTHRESHOLD = 200  # above this many datasets, FilteredPlots draws packed curves
+COLORBINS = 32  # number of colors (and packed curves) in packed mode
+LODTHRESHOLD = 10 ** 5  # samples above which series are drawn from min/max pyramids
+LODPOINTS = 2000  # points per series for overviews, when the view width is unknown
+PLOTCACHESIZE = 256 * 2 ** 20  # bytes of plot data FilteredPlots caches in total
+ENVELOPEPOINTS = 500  # grid points the series are resampled to for the band view
+ENVELOPEPERCENTILES = (5, 25)  # lower percentiles of the bands, besides min/max
+DENSITYTHRESHOLD = 200000  # rows above which the native parcoords draw densities
+DENSITYLINES = 5000  # selections up to this many rows are still drawn as lines
+DENSITYBINS = 64  # histogram bins per axis in density mode
+DENSITYLEVELS = 8  # shades of the density segments
+LOADSUBSAMPLE = 10  # the first chunk of a progressive load is every n-th key
+LOADBATCH = 100  # keys that are walked between two progress updates
+BARTHRESHOLD = 500  # above this many selected datasets, BarDock aggregates bars
+BARGROUPS = 100  # number of aggregated bars
+WATCHINTERVAL = 2000  # ms between two checks of the source in watch mode
+
+# the page of the plotly parcoords. it is loaded once, data is pushed with setData.
+# it also pushes the constraint ranges to the python side on every restyle. events
+# are coalesced to one per animation frame, the bridge debounces them further
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<script src="%PLOTLYJS%"></script>
+<script src="qrc:///qtwebchannel/qwebchannel.js"></script>
+<style>html, body, #plot {margin: 0; width: 100%; height: 100%;}</style>
+</head><body><div id="plot"></div><script>
+var gd = document.getElementById('plot');
+var layout = %LAYOUT%;
+var bridge = null;
+var pending = false;
+new QWebChannel(qt.webChannelTransport, function (channel) {
+    bridge = channel.objects.bridge;
+});
+
+function decode(b64) {
+    var str = atob(b64);
+    var bytes = new Uint8Array(str.length);
+    for (var i = 0; i < str.length; i++) { bytes[i] = str.charCodeAt(i); }
+    return new Float64Array(bytes.buffer);
+}
+
+function sendRanges() {
+    pending = false;
+    var lims = {};
+    gd.data[0].dimensions.forEach(function (dim) {
+        var r = dim.constraintrange;
+        if (r && r.length) {
+            if (Array.isArray(r[0])) { r = r[0]; }
+            lims[dim.label] = [r[0], r[1]];
+        }
+    });
+    if (bridge) { bridge.brushed(JSON.stringify(lims)); }
+}
+
+function setData(payload) {
+    var dims = payload.dims.map(function (dim) {
+        return {label: dim.label, values: decode(dim.values), range: dim.range};
+    });
+    var line = {color: decode(payload.color), colorscale: payload.colorscale};
+    var listening = gd.data !== undefined;
+    Plotly.react(gd, [{type: 'parcoords', dimensions: dims, line: line}], layout);
+    if (!listening) {
+        gd.on('plotly_restyle', function () {
+            if (!pending) {
+                pending = true;
+                requestAnimationFrame(sendRanges);
+            }
+        });
+    }
+}
+</script></body></html>
+"""
+
+
+def encodeArray(vals):
+    # float64 values as base64, decoded to a Float64Array on the page
+    vals = np.ascontiguousarray(vals, dtype="<f8")
+    return base64.b64encode(vals.tobytes()).decode("ascii")
+
+
+def plotlyBundle(folder):
+    # plotly.js as shipped with the plotly package, or a copy of it in folder
+    bundle = Path(plotly.__file__).parent / "package_data" / "plotly.min.js"
+    if not bundle.is_file():
+        bundle = Path(folder) / "plotly.min.js"
+        bundle.write_text(get_plotlyjs(), encoding="utf-8")
+    return bundle
 
 
 class parCoordDockArea(DockArea):
-    def __init__(self, noDataView=False):
+    progress = QtCore.Signal(int, int)
+
+    def __init__(self, noDataView=False, backend=None):
         super().__init__()
-        self.pc = pc = ParCoordWidget()
+        self.pc = pc = PARCOORDBACKENDS[backend or PARCOORDBACKEND]()
         pcd = Dock("parcoords")
 
         pcd.addWidget(pc)
@@ -44,37 +155,234 @@ class parCoordDockArea(DockArea):
         self.ld = ListDock(pc)
         self.addDock(self.ld, "left")
 
+        self.loader = None
+        self.watcher = None
+
     def setParcoordData(self, dfs, calculator=None):
         self.pc.setParcoordData(dfs, calculator)
 
+    def loadData(self, dfs):
+        # data that is not complete yet (see dataAnalysis.read) is loaded in the
+        # background and shown chunk by chunk, calculations run on the last chunk
+        if getattr(dfs, "complete", True):
+            self.setParcoordData(dfs)
+            return
+        self.loader = DataLoader(dfs)
+        self.loader.progress.connect(self.progress)
+        self.loader.chunkloaded.connect(self.addChunk)
+        self.loader.finished.connect(self.loadFinished)
+        self.loader.start()
+
+    def addChunk(self, metadata):
+        # chunks of a stopped loader may still be queued
+        if self.loader is None:
+            return
+        data = self.loader.data
+        data.addMetaData(metadata)
+        if getattr(self.pc, "dfs", None) is data:
+            # only the rows of the new keys are added, see ParCoordBase.appendData
+            self.pc.appendData(metadata)
+        elif len(data) > 1:
+            self.setParcoordData(data)
+
+    def loadFinished(self):
+        if self.loader is None:
+            return
+        data = self.loader.data
+        data.complete = True
+        persist = getattr(data, "persist", False)
+        self.setParcoordData(data, lambda dfs: doCalculations(dfs, persist=persist))
+
+    def watch(self, interval=WATCHINTERVAL):
+        # polls the source of the data every interval ms, and applies new, changed
+        # and removed datasets incrementally (see ParCoordBase.updateData). the files
+        # of the source are only kept open while they are read, see release
+        dfs = self.loader.data if self.loader is not None else None
+        dfs = getattr(self.pc, "dfs", None) if dfs is None else dfs
+        if hasattr(dfs, "release"):
+            dfs.release()
+        self.watcher = QtCore.QTimer()
+        self.watcher.setInterval(interval)
+        self.watcher.timeout.connect(self.checkSource)
+        self.watcher.start()
+
+    def checkSource(self):
+        dfs = getattr(self.pc, "dfs", None)
+        if not hasattr(dfs, "refresh"):
+            return
+        diff = dfs.refresh()
+        if diff is None or not any(diff):
+            return
+        # the results are not written into the store, somebody else is writing it
+        doCalculations(dfs, persist=False)
+        self.pc.updateData(*diff)
+
+    def stopLoading(self):
+        if self.loader is not None:
+            self.loader.requestInterruption()
+            self.loader.wait()
+            self.loader = None
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+
+class DataLoader(QtCore.QThread):
+    # walks the metadata of the keys that are missing in a LazyDataDict. the first
+    # chunk is a stratified subsample (every LOADSUBSAMPLE-th key), the following
+    # chunks double in size, so the view is refined only O(log n) times.
+    progress = QtCore.Signal(int, int)
+    chunkloaded = QtCore.Signal(object)
+
+    def __init__(self, data, subsample=LOADSUBSAMPLE):
+        super().__init__()
+        self.data = data
+        self.subsample = subsample
+
+    def chunks(self, keys):
+        first = keys[:: self.subsample]
+        rest = [x for idx, x in enumerate(keys) if idx % self.subsample]
+        yield first
+        size = max(1, len(first))
+        while rest:
+            size *= 2
+            yield rest[:size]
+            rest = rest[size:]
+
+    def run(self):
+        with self.data.opened() as store:
+            keys = [x for x in dataKeys(store) if x not in self.data]
+        done = 0
+        for chunk in self.chunks(keys):
+            metadata = {}
+            for start in range(0, len(chunk), LOADBATCH):
+                if self.isInterruptionRequested():
+                    return
+                batch = chunk[start : start + LOADBATCH]
+                with self.data.opened() as store:
+                    metadata.update(walkMetaData(store, batch))
+                done += len(batch)
+                self.progress.emit(done, len(keys))
+            self.chunkloaded.emit(metadata)
+
+
+class KeyTableModel(QtCore.QAbstractTableModel):
+    # virtual table of the datasets: their number, key and metadata (the matrix of
+    # the parcoords). nothing is stored per row: the visible rows are an index array
+    # into the keys, that is filtered by a mask and sorted with numpy, so filtering
+    # and sorting do not need a QSortFilterProxyModel that asks for every row.
+    def __init__(self):
+        super().__init__()
+        self.keys = np.empty(0, dtype=object)
+        self.values = np.empty((0, 0))
+        self.columns = ["#", "name"]
+        self.mask = None
+        self.sortkey = None
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def setMatrix(self, meta):
+        self.beginResetModel()
+        self.keys = np.asarray(meta.index, dtype=object)
+        self.values = meta.values
+        self.columns = ["#", "name"] + list(meta.columns)
+        if self.mask is not None and len(self.mask) != len(self.keys):
+            self.mask = None
+        self.updateRows()
+        self.endResetModel()
+
+    def setMask(self, mask):
+        # mask: bool per key, None shows all keys
+        self.beginResetModel()
+        self.mask = mask
+        self.updateRows()
+        self.endResetModel()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.beginResetModel()
+        self.sortkey = (column, order)
+        self.updateRows()
+        self.endResetModel()
+
+    def updateRows(self):
+        if self.mask is None:
+            rows = np.arange(len(self.keys))
+        else:
+            rows = np.flatnonzero(self.mask)
+        if self.sortkey is not None and self.sortkey[0] < len(self.columns):
+            column, order = self.sortkey
+            if column == 0:
+                vals = rows
+            elif column == 1:
+                vals = self.keys[rows]
+            else:
+                vals = self.values[rows, column - 2]
+            rows = rows[np.argsort(vals, kind="stable")]
+            if order == QtCore.Qt.DescendingOrder:
+                rows = rows[::-1]
+        self.rows = rows
+
+    def keyAt(self, row):
+        return self.keys[self.rows[row]]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role not in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+            return None
+        row = self.rows[index.row()]
+        column = index.column()
+        if role == QtCore.Qt.ToolTipRole or column == 1:
+            return self.keys[row]
+        if column == 0:
+            return str(row)
+        val = self.values[row, column - 2]
+        return "" if np.isnan(val) else f"{val:.6g}"
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.columns[section]
+        return None
+
 
 class ListDock(Dock):
+    # the datasets as a table, that can be sorted by any column and restricted to
+    # the selection of the parcoords
     selectionChanged = QtCore.Signal(object)
 
     def __init__(self, pc):
         super().__init__("data list")
         self.parcoords = pc
         self.view = QtWidgets.QTreeView()
-        self.mdl = QtGui.QStandardItemModel()
+        self.mdl = KeyTableModel()
         self.view.setModel(self.mdl)
+        self.view.setUniformRowHeights(True)
+        self.view.setRootIsDecorated(False)
+        self.view.setAlternatingRowColors(True)
+        self.view.header().setSortIndicator(0, QtCore.Qt.AscendingOrder)
+        self.view.setSortingEnabled(True)
+        self.onlySelected = QtWidgets.QCheckBox("only selected")
+        self.onlySelected.toggled.connect(self.updateSelection)
         self.setMaximumWidth(250)
+        self.addWidget(self.onlySelected)
         self.addWidget(self.view)
         self.parcoords.datachanged.connect(self.setdata)
+        self.parcoords.dataupdated.connect(self.setdata)
+        self.parcoords.selectionchanged.connect(self.updateSelection)
         self.view.selectionModel().selectionChanged.connect(self.emitCurrentNode)
 
-    def setdata(self):
-        self.mdl.clear()
-        self.mdl.setHorizontalHeaderLabels(["#", "name"])
-        self.view.setAlternatingRowColors(True)
-        root = self.mdl.invisibleRootItem()
-        for idx, k in enumerate(self.parcoords.dfs.keys()):
-            i1 = QtGui.QStandardItem(str(idx))
-            i1.setEditable(False)
-            i1.setToolTip(k)
-            i2 = QtGui.QStandardItem(k)
-            i2.setEditable(False)
-            i2.setToolTip(k)
-            root.appendRow([i1, i2])
+    def setdata(self, *_):
+        self.mdl.setMatrix(self.parcoords.meta)
+        self.updateSelection()
+
+    def updateSelection(self, *_):
+        if self.onlySelected.isChecked():
+            self.mdl.setMask(self.parcoords.filter.mask)
+        else:
+            self.mdl.setMask(None)
 
     def emitCurrentNode(self):
         selectedIDX = self.view.selectedIndexes()
@@ -82,11 +390,11 @@ class ListDock(Dock):
             return
         else:
             selectedIDX = selectedIDX[0]
-        selectedItem = self.mdl.itemFromIndex(selectedIDX)
-        self.selectionChanged.emit(selectedItem)
+        self.selectionChanged.emit(self.mdl.keyAt(selectedIDX.row()))
 
 
 class HistDock(Dock):
+    # histogram of a metadata column, the selected datasets over all of them
     def __init__(self):
         super().__init__("metadata histograms")
         self.plt = pg.GraphicsLayoutWidget()
@@ -96,30 +404,47 @@ class HistDock(Dock):
         self.layout.setSpacing(0)
         self.layout.setContentsMargins(0, 0, 0, 0)
         self.sel.currentTextChanged.connect(self.updateData)
+        # the plot is kept, only its items are replaced
+        self.p1 = p1 = self.plt.addPlot()
+        p1.showGrid(1, 1, 0.6)
+        p1.setLabel("bottom", "value")
+        p1.setLabel("left", "cnt")
 
-    def setData(self, parcoords):
-        ks = tuple(parcoords.minmax.keys())
+    def setData(self, parcoords, stats, rows):
         self.pc = parcoords
-        self.sel.addItems(ks)
-        self.sel.setCurrentText(ks[0])
+        self.stats = stats
+        self.rows = rows
+        setColumns(self.sel, tuple(parcoords.minmax.keys()))
         self.updateData()
 
     def updateData(self):
         sel = self.sel.currentText()
-        hist, histEdges = np.histogram(self.pc.meta[sel])
-        self.plt.clear()
-        p1 = self.plt.addPlot()
-        p1.showGrid(1, 1, 0.6)
-        p1.setLabel("bottom", "value")
-        p1.setLabel("left", "cnt")
+        if not sel:
+            return
+        hist, histEdges = self.stats.histogram(sel)
+        p1 = self.p1
+        p1.clear()
 
         xs = (histEdges[:-1] + histEdges[1:]) / 2
         w = histEdges[1] - histEdges[0]
-        bi = pg.BarGraphItem(x=xs, height=hist, width=w, brush="r")
+        bi = pg.BarGraphItem(x=xs, height=hist, width=w, brush=(128, 128, 128, 100))
         p1.addItem(bi)
+        self.selbars = pg.BarGraphItem(x=xs, height=hist, width=w, brush="r")
+        p1.addItem(self.selbars)
+        self.setSelection(self.rows)
+
+    def setSelection(self, rows):
+        # only the heights of the selected bars change
+        self.rows = rows
+        sel = self.sel.currentText()
+        if sel:
+            self.selbars.setOpts(height=self.stats.histogram(sel, rows)[0])
 
 
 class BarDock(Dock):
+    # the values of two metadata columns per selected dataset. above BARTHRESHOLD
+    # datasets, they are aggregated to BARGROUPS bars of consecutive datasets that
+    # show the mean, with the min/max as error bars
     def __init__(self):
         super().__init__("metadata bardiags")
         self.plt = pg.GraphicsLayoutWidget()
@@ -134,48 +459,66 @@ class BarDock(Dock):
         self.layout.setContentsMargins(0, 0, 0, 0)
         self.sel.currentTextChanged.connect(self.updateData)
         self.sel2.currentTextChanged.connect(self.updateData)
-
-    def setData(self, parcoords):
+        # the plots are kept, only their items are replaced
+        self.p1 = self.plt.addPlot()
+        self.p2 = self.plt2.addPlot()
+        for p in (self.p1, self.p2):
+            p.showGrid(1, 1, 0.6)
+            p.setLabel("bottom", "dataset")
+            p.setLabel("left", "val")
+        self.p1.setXLink(self.p2)
+
+    def setData(self, parcoords, stats, rows):
         ks = tuple(parcoords.minmax.keys())
         self.pc = parcoords
-        self.sel.addItems(ks)
-        self.sel.setCurrentText(ks[0])
-        self.sel2.addItems(ks)
-        self.sel2.setCurrentText(ks[1])
+        self.rows = rows
+        setColumns(self.sel, ks)
+        setColumns(self.sel2, ks, ks[1])
         self.updateData()
 
     def updateData(self):
-        self.plt.clear()
-        self.plt2.clear()
-
-        sel = self.sel.currentText()
-        if not sel:
-            return
-
-        p1 = self.plt.addPlot()
-        p1.showGrid(1, 1, 0.6)
-        p1.setLabel("bottom", "dataset")
-        p1.setLabel("left", "val")
-
-        xs = range(len(self.pc.dfs))
-        ys = [x.attrs[sel] for x in self.pc.dfs.values()]
-        bi = pg.BarGraphItem(x=xs, height=ys, width=0.9, brush="r")
-        p1.addItem(bi)
-
-        sel2 = self.sel2.currentText()
-        if not sel2:
-            return
-
-        p2 = self.plt2.addPlot()
-        p2.showGrid(1, 1, 0.6)
-        p2.setLabel("bottom", "dataset")
-        p2.setLabel("left", "val")
-
-        xs = range(len(self.pc.dfs))
-        ys = [x.attrs[sel2] for x in self.pc.dfs.values()]
-        bi = pg.BarGraphItem(x=xs, height=ys, width=0.9, brush="r")
-        p2.addItem(bi)
-        p1.setXLink(p2)
+        self.plots = [(self.p1, self.sel.currentText())]
+        self.plots.append((self.p2, self.sel2.currentText()))
+        self.setSelection(self.rows)
+
+    def setSelection(self, rows):
+        self.rows = rows
+        for plt, col in self.plots:
+            plt.clear()
+            if col:
+                for item in self.barItems(self.pc.meta[col].values, rows):
+                    plt.addItem(item)
+
+    def barItems(self, vals, rows):
+        if len(rows) <= BARTHRESHOLD:
+            return [pg.BarGraphItem(x=rows, height=vals[rows], width=0.9, brush="r")]
+        starts = np.linspace(0, len(rows), BARGROUPS + 1).astype(int)
+        ends = starts[1:] - 1
+        starts = starts[:-1]
+        vals = vals[rows]
+        valid = ~np.isnan(vals)
+        cnt = np.add.reduceat(valid, starts)
+        with np.errstate(invalid="ignore"):
+            mean = np.add.reduceat(np.where(valid, vals, 0), starts) / cnt
+        minval = np.fmin.reduceat(vals, starts)
+        maxval = np.fmax.reduceat(vals, starts)
+        xs = (rows[starts] + rows[ends]) / 2
+        ws = rows[ends] - rows[starts] + 0.9
+        bars = pg.BarGraphItem(x=xs, height=mean, width=ws, brush="r")
+        errs = pg.ErrorBarItem(x=xs, y=mean, top=maxval - mean, bottom=mean - minval)
+        return [bars, errs]
+
+
+def setColumns(combo, columns, default=None):
+    # fills a combo box with columns, keeping its current column if it is still there
+    current = combo.currentText()
+    if current not in columns:
+        current = columns[0] if default is None else default
+    combo.blockSignals(True)
+    combo.clear()
+    combo.addItems(columns)
+    combo.setCurrentText(current)
+    combo.blockSignals(False)
 
 
 class StatsWidget(DockArea):
@@ -184,6 +527,8 @@ class StatsWidget(DockArea):
 
         self.pc = parcoords
         self.pc.datachanged.connect(self.createStats)
+        self.pc.dataupdated.connect(self.createStats)
+        self.pc.selectionchanged.connect(self.updateSelection)
 
         self.table = QtWidgets.QPlainTextEdit()
         f = self.table.font()
@@ -199,39 +544,91 @@ class StatsWidget(DockArea):
         self.BarDock = BarDock()
         self.addDock(self.BarDock, "below", self.HistDock)
 
-    def createStats(self):
+    def detach(self):
+        # the parcoords may outlive the docks, they must not follow it after the
+        # window is closed
+        connections = (
+            (self.pc.datachanged, self.createStats),
+            (self.pc.dataupdated, self.createStats),
+            (self.pc.selectionchanged, self.updateSelection),
+        )
+        for signal, slot in connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+
+    def createStats(self, *_):
+        # the columns are sorted once per data, a selection then only costs its size
+        self.stats = MetaStats(self.pc.meta, self.pc.filter.sorted)
+        self.rows = np.flatnonzero(self.pc.filter.mask)
+        self.updateTable()
+        self.HistDock.setData(self.pc, self.stats, self.rows)
+        self.BarDock.setData(self.pc, self.stats, self.rows)
+
+    def updateSelection(self, keys):
+        self.rows = np.sort(self.pc.meta.index.get_indexer(keys))
+        self.updateTable()
+        self.HistDock.setSelection(self.rows)
+        self.BarDock.setSelection(self.rows)
+
+    def updateTable(self):
 
         self.table.clear()
 
         self.dfs = self.pc.dfs
-        minmaxdata = self.pc.minmax
         minmax = [["key", "min", "max", "med"]]
-        for k, v in minmaxdata.items():
-            minmax.append([k] + list(v))
-        lines = []
+        for k in self.pc.minmax:
+            minmax.append([k] + list(self.stats.describe(k, self.rows)[1:]))
+        lines = [f"{len(self.rows)}/{len(self.pc.meta)} datasets selected\n"]
         lines.append(tabulate(minmax, headers="firstrow", tablefmt="psql") + "\n\n")
 
         self.table.setPlainText("\n".join(lines))
-        self.HistDock.setData(self.pc)
-        self.BarDock.setData(self.pc)
 
 
-def mkgui():
+def webEngine():
+    # only the web backend needs chromium, so it is imported on demand. qt wants it
+    # imported before the application is created, see mkgui
+    widgets = importlib.import_module(pg.Qt.lib + ".QtWebEngineWidgets")
+    channel = importlib.import_module(pg.Qt.lib + ".QtWebChannel")
+    return widgets, channel
+
+
+class ParCoordWindow(QtWidgets.QMainWindow):
+    def closeEvent(self, event):
+        self.parcoords.stopLoading()
+        self.parcoords.statswidget.detach()
+        super().closeEvent(event)
+
+
+def mkgui(backend=None):
+    if (backend or PARCOORDBACKEND) == "web":
+        webEngine()
     pg.mkQApp("parcoord")
-    win = QtWidgets.QMainWindow()
-    area = parCoordDockArea()
+    win = ParCoordWindow()
+    area = parCoordDockArea(backend=backend)
     win.setCentralWidget(area)
     win.parcoords = area
+
+    def showProgress(done, total):
+        win.statusBar().showMessage(f"loaded metadata of {done}/{total} datasets")
+
+    area.progress.connect(showProgress)
     return win
 
 
 # implements: e5
-def visualize(dfs, block=True):
-    win = mkgui()
-    win.parcoords.setParcoordData(dfs)
+def visualize(dfs, block=True, backend=None, watch=False):
+    win = mkgui(backend)
+    win.parcoords.loadData(dfs)
+    if watch:
+        win.parcoords.watch()
     win.show()
     if block and not DBG_DONTBLOCK:  # pragma: no cover
         pg.exec()
+    if block:
+        # the caller may close the data after we return
+        win.parcoords.stopLoading()
 
 
 class FilteredPlots(pg.QtWidgets.QWidget):
@@ -243,18 +640,33 @@ class FilteredPlots(pg.QtWidgets.QWidget):
         self.setLayout(self.la)
         self.plt = pg.GraphicsLayoutWidget()
         self.sel = pg.QtWidgets.QComboBox()
-        self.la.addWidget(self.sel)
-        self.la.addWidget(self.plt)
+        self.bandview = QtWidgets.QCheckBox("bands")
+        self.la.addWidget(self.sel, 0, 0)
+        self.la.addWidget(self.bandview, 0, 1)
+        self.la.addWidget(self.plt, 1, 0, 1, 2)
+        self.la.setColumnStretch(0, 1)
+        self.percentiles = ENVELOPEPERCENTILES
+        self.buffers = OrderedDict()
         self.la.setSpacing(0)
         self.la.setContentsMargins(0, 0, 0, 0)
         self.pc = parcoords
         self.pc.datachanged.connect(self.createPlots)
+        self.pc.dataupdated.connect(self.updateData)
         self.pc.selectionchanged.connect(self.updatePlots)
         self.sel.currentTextChanged.connect(self.drawplt)
+        self.bandview.toggled.connect(self.drawplt)
+        # the plot is kept, only its items are replaced. plots removed from the
+        # layout are deleted by the garbage collector later, which qt may not survive
+        self.p1 = p1 = self.plt.addPlot()
+        p1.showGrid(1, 1, 0.6)
+        p1.addLegend()
+        p1.sigXRangeChanged.connect(self.updateLOD)
 
     def createPlots(self):
         self.dfs = self.pc.dfs
         self.filt = tuple(self.dfs.keys())
+        self.pyramids = {}
+        self.buffers = OrderedDict()
         self.sel.clear()
 
         df0 = self.dfs[self.filt[0]]
@@ -263,104 +675,398 @@ class FilteredPlots(pg.QtWidgets.QWidget):
         self.drawplt()
 
     def drawplt(self, _=None):
-        df0 = self.dfs[self.filt[0]]
-        col = self.sel.currentText()
+        self.col = col = self.sel.currentText()
+        if not col:
+            return
+        df0 = self.dfs[next(iter(self.dfs))]
         xname = df0.index.name
-        self.plt.clear()
         self.pltLines = {}
-        p1 = self.plt.addPlot()
-        p1.addLegend()
-        p1.showGrid(1, 1, 0.6)
+        self.lodLines = {}
+        self.lodview = None
+        self.packs = None
+        self.bands = None
+        p1 = self.p1
+        p1.clear()
+        p1.enableAutoRange()
         p1.setLabel("bottom", xname)
         p1.setLabel("left", col)
-        keynos = dict((k, idx) for idx, k in enumerate(self.dfs.keys()))
-        for key in self.filt:
-            name = f"#{keynos[key]}"
-            df = self.dfs[key]
-            meta = df.attrs
-            pen = self.pc.colormap.map2Col(meta[self.pc.colormapkey])
-            self.pltLines[key] = p1.plot(
-                x=df.index.values, y=df[col], pen=pen, name=name
+        if self.bandview.isChecked():
+            self.drawEnvelope(p1)
+        elif len(self.dfs) > PACKTHRESHOLD:
+            self.drawPacked(p1, col)
+        else:
+            # all curves are drawn, the ones that are not selected are hidden
+            for idx, key in enumerate(self.dfs.keys()):
+                self.addLine(key, f"#{idx}")
+        self.showSelection()
+        self.evictBuffers()
+        self.finished.emit()
+
+    def columnBuffers(self, col):
+        # the prepared plot data of a column: the x, y of every line, the packs and
+        # the envelope. they are kept for the last columns, so switching between
+        # columns does not read the data again
+        buf = self.buffers.get(col)
+        if buf is None:
+            buf = self.buffers[col] = {"lines": {}, "packs": None, "envelope": None}
+        self.buffers.move_to_end(col)
+        return buf
+
+    def evictBuffers(self):
+        # the oldest columns are dropped first. the current column counts as well,
+        # its curves keep their data if its buffers are dropped
+        def nbytes(buf):
+            arrays = [a for xy in buf["lines"].values() for a in xy]
+            if buf["packs"] is not None:
+                arrays += [a for pack in buf["packs"] for a in pack[2:]]
+            if buf["envelope"] is not None:
+                arrays.append(buf["envelope"]["values"])
+            return sum(a.nbytes for a in arrays)
+
+        sizes = [nbytes(buf) for buf in self.buffers.values()]
+        while sum(sizes) > PLOTCACHESIZE and self.buffers:
+            self.buffers.popitem(last=False)
+            sizes.pop(0)
+
+    def lineData(self, key, col):
+        lines = self.columnBuffers(col)["lines"]
+        xy = lines.get(key)
+        if xy is None:
+            # views would keep the whole frame of the series alive
+            xy = tuple(
+                x if x.base is None else x.copy() for x in self.plotData(key, col)
             )
+            lines[key] = xy
+        return xy
+
+    def addLine(self, key, name):
+        pen = self.pc.colormap.map2Col(self.pc.meta.at[key, self.pc.colormapkey])
+        x, y = self.lineData(key, self.col)
+        self.pltLines[key] = self.p1.plot(x=x, y=y, pen=pen, name=name)
+        if (key, self.col) in self.pyramids:
+            self.lodLines[key] = self.pltLines[key]
+
+    def updateData(self, added, changed, removed):
+        # only the curves of the datasets that changed are touched. new curves are
+        # hidden, until the parcoords select them
+        dropped = set(changed) | set(removed)
+        self.pyramids = dict(
+            (k, v) for k, v in self.pyramids.items() if k[0] not in dropped
+        )
+        for buf in self.buffers.values():
+            for key in dropped:
+                buf["lines"].pop(key, None)
+            buf["packs"] = buf["envelope"] = None
+        if not self.col:
+            return
+        if self.bands is not None:
+            self.drawplt()
+            return
+        if self.packs is not None or len(self.dfs) > PACKTHRESHOLD:
+            # packed curves are concatenated per color, they are packed again
+            self.drawplt()
+            return
+        for key in list(removed) + list(changed):
+            item = self.pltLines.pop(key, None)
+            self.lodLines.pop(key, None)
+            if item is not None:
+                self.p1.removeItem(item)
+        keynos = dict((k, idx) for idx, k in enumerate(self.dfs.keys()))
+        for key in list(changed) + list(added):
+            self.addLine(key, f"#{keynos[key]}")
+            self.pltLines[key].setVisible(key in self.filt)
+        self.lodview = None
+        self.updateLOD()
+        self.evictBuffers()
         self.finished.emit()
-        self.updatePlots()
 
     def updatePlots(self, filt=None):
-        if filt == self.filt:
-            return
         if filt is None:
             filt = tuple(self.dfs.keys())
+        if tuple(filt) == tuple(self.filt):
+            return
+        # only the curves that enter or leave the selection are touched
+        changed = set(filt).symmetric_difference(self.filt)
         self.filt = filt
-        for k, v in self.pltLines.items():
-            vis = k in self.filt
-            v.setVisible(vis)
+        self.showSelection(changed)
         self.finished.emit()
 
+    def showSelection(self, changed=None):
+        # changed: the keys whose selection changed, None updates all curves
+        selected = set(self.filt)
+        if self.packs is not None:
+            self.updatePacked(changed)
+        if self.bands is not None:
+            self.updateEnvelope()
+        keys = self.pltLines if changed is None else changed
+        for k in keys:
+            item = self.pltLines.get(k)
+            if item is not None:
+                item.setVisible(k in selected)
+        if self.lodLines:
+            # curves that were hidden may show a different range
+            self.lodview = None
+            self.updateLOD()
+
+    def plotData(self, key, col, xmin=None, xmax=None, npoints=LODPOINTS):
+        # x, y of a series, long series are decimated to npoints in [xmin, xmax]
+        pyramid = self.pyramids.get((key, col))
+        if pyramid is None:
+            x, y = self.seriesData(key, col)
+            if len(x) <= LODTHRESHOLD:
+                return x, y
+            loader = lambda a, b: self.seriesData(key, col, a, b)  # noqa: E731
+            pyramid = MinMaxPyramid(x, y, loader)
+            self.pyramids[(key, col)] = pyramid
+        return pyramid.get(xmin, xmax, npoints)
+
+    def seriesData(self, key, col, start=None, stop=None):
+        # packed data is used directly, without creating a frame. of sources with
+        # select, only the rows [start, stop) are read
+        if isinstance(self.dfs, RaggedData):
+            x, y = self.dfs.series(key, col)
+            return x[start:stop], y[start:stop]
+        if start is None and stop is None:
+            df = self.dfs[key]
+        elif hasattr(self.dfs, "select"):
+            df = self.dfs.select(key, start, stop)
+        else:
+            df = self.dfs[key].iloc[start:stop]
+        return df.index.values, df[col].values
 
-class ParCoordWidget(QtWebEngineWidgets.QWebEngineView):
-    selectionchanged = QtCore.Signal(list)
-    datachanged = QtCore.Signal()
-
-    def __init__(self):
+    def updateLOD(self, *_):
+        # redraws the decimated curves for the current view range and width
+        if not self.lodLines:
+            return
+        xmin, xmax = self.p1.vb.viewRange()[0]
+        view = (xmin, xmax, max(1, int(self.p1.vb.width())))
+        if view == self.lodview:
+            return
+        self.lodview = view
+        for key, item in self.lodLines.items():
+            if item.isVisible():
+                x, y = self.plotData(key, self.col, *view)
+                item.setData(x=x, y=y)
+
+    def drawPacked(self, plt, col):
+        # all curves of one color bin are concatenated into a single plot item,
+        # separated by gaps in its connect array. a selection change only masks
+        # the points of the buffers of the bins, whose curves entered or left it
+        keys = tuple(self.dfs.keys())
+        self.keypos = dict((k, idx) for idx, k in enumerate(keys))
+        buf = self.columnBuffers(col)
+        if buf["packs"] is None:
+            buf["packs"] = self.packColumn(keys, col)
+        colors = self.pc.colormap.map(
+            (np.arange(COLORBINS) + 0.5) / COLORBINS, mode="qcolor"
+        )
+        self.selected = np.zeros(len(keys), dtype=bool)
+        self.keybins = np.zeros(len(keys), dtype=int)
+        self.packs = []
+        for colorbin, members, lengths, x, y, connect in buf["packs"]:
+            self.keybins[members] = len(self.packs)
+            item = plt.plot(pen=colors[colorbin])
+            self.packs.append((item, members, lengths, x, y, connect))
+
+    def packColumn(self, keys, col):
+        minval, _, span = self.pc.minmax[self.pc.colormapkey]
+        colorvals = self.pc.meta[self.pc.colormapkey].reindex(keys).values
+        bins = ((colorvals - minval) / span * COLORBINS).astype(int)
+        bins = np.clip(bins, 0, COLORBINS - 1)
+
+        xs, ys = [], []
+        for key in keys:
+            x, y = self.plotData(key, col)
+            xs.append(x)
+            ys.append(y)
+        lengths = np.array([len(x) for x in xs])
+
+        packs = []
+        for colorbin in np.unique(bins):
+            members = np.flatnonzero(bins == colorbin)
+            x = np.concatenate([xs[idx] for idx in members])
+            y = np.concatenate([ys[idx] for idx in members])
+            connect = np.ones(len(x), dtype=bool)
+            connect[np.cumsum(lengths[members]) - 1] = False
+            packs.append((colorbin, members, lengths[members], x, y, connect))
+        return packs
+
+    def updatePacked(self, changed=None):
+        selected = set(self.filt)
+        if changed is None:
+            keys = self.keypos.keys()
+            packs = range(len(self.packs))
+        else:
+            keys = [k for k in changed if k in self.keypos]
+            packs = np.unique(self.keybins[[self.keypos[k] for k in keys]])
+        pos = [self.keypos[k] for k in keys]
+        self.selected[pos] = [k in selected for k in keys]
+        for idx in packs:
+            item, members, lengths, x, y, connect = self.packs[idx]
+            points = np.repeat(self.selected[members], lengths)
+            item.setData(x=x[points], y=y[points], connect=connect[points])
+
+    def envelopeData(self, col):
+        # all series of a column, resampled to one grid. cached per column, so a
+        # selection change (or switching back to a column) only recomputes the bands
+        buf = self.columnBuffers(col)
+        if buf["envelope"] is not None:
+            return buf["envelope"]
+        keys = tuple(self.dfs.keys())
+        if isinstance(self.dfs, RaggedData):
+            x, y = self.dfs.x, self.dfs.y[:, self.dfs.columns.get_loc(col)]
+            offsets = self.dfs.offsets
+        else:
+            xs, ys = zip(*(self.seriesData(key, col) for key in keys))
+            offsets = np.cumsum([0] + [len(x) for x in xs])
+            x, y = np.concatenate(xs), np.concatenate(ys)
+        starts, ends = offsets[:-1], offsets[1:]
+        valid = ends > starts
+        if valid.any():
+            xmin, xmax = x[starts[valid]].min(), x[ends[valid] - 1].max()
+        else:
+            xmin, xmax = 0, 0
+        grid = np.linspace(xmin, xmax, ENVELOPEPOINTS)
+        keypos = dict((k, idx) for idx, k in enumerate(keys))
+        env = {"grid": grid, "values": resampleSeries(x, y, offsets, grid)}
+        env.update(keypos=keypos, filt=None, bands=None)
+        buf["envelope"] = env
+        return env
+
+    def drawEnvelope(self, plt):
+        # min/max, the percentile bands and the median of the selected series. the
+        # fills are stacked, so inner bands are drawn darker
+        color = self.pc.colormap.map([0.5], mode="qcolor")[0]
+        brush = pg.mkBrush(color.red(), color.green(), color.blue(), 60)
+        lower = sorted(set(self.percentiles) | {0})
+        self.bandpercentiles = lower + [50] + [100 - p for p in reversed(lower)]
+        self.bands = []
+        for _ in lower:
+            # the limits are added to the plot too, so it owns them with the fill
+            curves = (pg.PlotCurveItem(pen=None), pg.PlotCurveItem(pen=None))
+            for curve in curves:
+                plt.addItem(curve)
+            plt.addItem(pg.FillBetweenItem(*curves, brush=brush))
+            self.bands.append(curves)
+        self.median = plt.plot(pen=pg.mkPen(color, width=2))
+
+    def updateEnvelope(self):
+        env = self.envelopeData(self.col)
+        if env["filt"] != tuple(self.filt):
+            keypos = env["keypos"]
+            selected = np.zeros(len(keypos), dtype=bool)
+            selected[[keypos[k] for k in self.filt if k in keypos]] = True
+            values = env["values"][selected]
+            env["bands"] = percentileBands(values, self.bandpercentiles)
+            env["filt"] = tuple(self.filt)
+        bands = env["bands"]
+        valid = ~np.isnan(bands[0])
+        x = env["grid"][valid]
+        for idx, (lo, hi) in enumerate(self.bands):
+            lo.setData(x=x, y=bands[idx][valid])
+            hi.setData(x=x, y=bands[-1 - idx][valid])
+        self.median.setData(x=x, y=bands[len(self.bands)][valid])
+
+
+class BrushBridge(QtCore.QObject):
+    # receives the brush events of the page. only the latest event of a burst is
+    # passed on, after no new event came in for BRUSHDEBOUNCE ms
+    def __init__(self, callback):
         super().__init__()
-
-        self.td = tempfile.TemporaryDirectory()
-        self.tempfile = self.td.name + "/tmp.html"
-        self.loadFinished.connect(self.onloadFinished)
-        self._page = self.page()
+        self.callback = callback
+        self.latest = None
         self.timer = QtCore.QTimer()
-        self.timer.setInterval(250)
-        self.timer.timeout.connect(self.getFilteredKeys)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(BRUSHDEBOUNCE)
+        self.timer.timeout.connect(self.flush)
 
-    def setParcoordData(self, dfs, calculator=None):
-        if calculator is not None:
-            calculator(dfs)
-        meta = getMetaMatrix(dfs)
+    @QtCore.Slot(str)
+    def brushed(self, lims):
+        self.latest = lims
+        self.timer.start()
 
-        # for the parcoords, drop all metadata that is constant
-        nu = meta.nunique()
-        dropcols = nu[nu == 1].index
-        meta = meta.drop(dropcols, axis=1)
+    def flush(self):
+        lims, self.latest = self.latest, None
+        if lims is not None:
+            self.callback(lims)
 
-        dims = [dict(label=k, values=meta[k]) for k in meta.columns]
-        self.meta = meta
-        self.dfs = dfs
 
-        csname = "Turbo"
-        csvar = meta.columns[0]
-        order = np.argsort(dims[0]["values"])
-        for idx in range(len(dims)):
-            dims[idx]["values"] = dims[idx]["values"][order]
+def dropConstant(meta):
+    # for the parcoords, drop all metadata that is constant
+    nu = meta.nunique()
+    dropcols = nu[nu == 1].index
+    return meta.drop(dropcols, axis=1)
 
-        cs = getattr(pcol.sequential, csname)
 
-        colornumbers = [float(x) for x in dims[0]["values"]]
-        line = dict(color=colornumbers, colorscale=csname)
-        pc = go.Parcoords(dimensions=dims, line=line)
-        fig = go.Figure(data=pc)
-        fig.layout.template = "plotly_dark"
-        html = fig.to_html()
+class ParCoordBase:
+    # everything the parcoords backends share: the metadata matrix, its filter, the
+    # min/max values and the colormap. subclasses define the selectionchanged,
+    # datachanged and dataupdated signals, and draw the data in showData, with the
+    # current limits of the filter as brushes.
+    csname = "Turbo"
 
-        open(self.tempfile, "w").write(html)
-        url = QtCore.QUrl.fromLocalFile(str(Path(self.tempfile).resolve()))
-        self.load(url)
+    def setParcoordData(self, dfs, calculator=None):
+        if calculator is not None:
+            calculator(dfs)
+        fullmeta = getMetaMatrix(dfs)
+        meta = dropConstant(fullmeta)
+        if not len(meta.columns):
+            # ie no runs, or a single one. the views keep what they show
+            log.warning(f"nothing to show, no metadata of the {len(dfs)} runs varies")
+            return
 
+        self.fullmeta = fullmeta
+        self.meta = meta
+        self.dfs = dfs
+        self.filter = RangeFilter(meta)
         self.oldfilts = meta.index
 
         self.calcMinMaxValues()
-        csminmax = self.minmax[csvar]
+        csvar = meta.columns[0]
+        cs = getattr(pcol.sequential, self.csname)
         pos = np.linspace(0, 1, len(cs))
         cm = pg.ColorMap(pos, cs)
 
         def map2Col(x):
-            return cm[((x - csminmax[0]) / csminmax[2])]
+            minval, _, span = self.minmax[csvar]
+            return cm[((x - minval) / span)]
 
         cm.map2Col = map2Col
         self.colormap = cm
         self.colormapkey = csvar
 
+        self.showData()
         self.datachanged.emit()
 
+    def updateData(self, added=(), changed=(), removed=(), fullmeta=None):
+        # applies changes of the datasets (see LazyDataDict.refresh) without setting
+        # up the views again: the parcoords are redrawn with the current brushes,
+        # the other views get dataupdated. if the axes change, everything is rebuilt.
+        # fullmeta is the new matrix, if the caller knows it
+        self.fullmeta = getMetaMatrix(self.dfs) if fullmeta is None else fullmeta
+        meta = dropConstant(self.fullmeta)
+        if list(meta.columns) != list(self.meta.columns):
+            self.setParcoordData(self.dfs)
+            return
+        lims = self.filter.lims
+        self.meta = meta
+        self.filter = RangeFilter(meta)
+        self.filter.select(lims)
+        self.calcMinMaxValues()
+        self.showData()
+        self.dataupdated.emit(list(added), list(changed), list(removed))
+        self.getFilteredKeys()
+
+    def appendData(self, metadata):
+        # adds new datasets (key -> attrs, ie a chunk of a progressive load). only
+        # their rows are converted and appended to the matrix
+        new = metaMatrix(metadata)
+        if self.fullmeta.columns.equals(new.columns):
+            fullmeta = pd.concat([self.fullmeta, new])
+        else:
+            fullmeta = None
+        self.updateData(added=list(new.index), fullmeta=fullmeta)
+
     def calcMinMaxValues(self):
         self.minmax = {}
         for k in self.meta.columns:
@@ -368,65 +1074,237 @@ class ParCoordWidget(QtWebEngineWidgets.QWebEngineView):
             maxval = max(self.meta[k])
             self.minmax[k] = (minval, maxval, maxval - minval)
 
-    def getFilteredKeys(self, axlims=None):
-        if axlims is None:
-            return self.getAxLimits()
-        lims = {}
-        for k, v in json.loads(axlims).items():
-            vs = v.split(",")
-            if len(vs) <= 2:
-                continue
-            minval = float(vs[0])
-            maxval = float(vs[-1])
-            start = float(vs[1])
-            end = start + float(vs[2])
-            span = maxval - minval
-
-            startrel = min(1, max(0, start - minval) / span)
-            endrel = min(1, max(0, end - minval) / span)
-            s, e, sp = self.minmax[k]
-            lims[k] = (s + startrel * sp, s + endrel * sp)
-
-        df = self.meta
-        for k, (minv, maxv) in lims.items():
-            df = df[(df[k] >= minv) & (df[k] <= maxv)]
-
-        filts = df.index
+    def getFilteredKeys(self, lims=None):
+        # lims: dict (or its json) of axis label -> [min, max] in data units.
+        # axes that are not given are not filtered. None keeps the current limits
+        if lims is None:
+            lims = self.filter.lims
+        elif isinstance(lims, str):
+            lims = json.loads(lims)
+        lims = dict((k, v) for k, v in lims.items() if v and k in self.minmax)
+
+        filts = self.filter.getKeys(lims)
         if not filts.equals(self.oldfilts):
             self.selectionchanged.emit(list(filts.values))
         self.oldfilts = filts
 
-    def getAxLimits(self):
-
-        self._page.runJavaScript(
-            """
-        var prefixfun = (prefix) =>{if (prefix === 'svg'){
-            return 'http://www.w3.org/2000/svg';}else{return null;}};
-        (function () {
-        res1 = document.evaluate(
-        '//svg:line[@stroke-dasharray and @class="highlight"]/@stroke-dasharray',
-                document,
-                prefixfun,
-                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,null);
-
-            res2 = document.evaluate(
-                '//svg:g[@class="axis-heading"]',
-                document,
-                prefixfun,
-                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,null);
-
-            var dct = {}
-            for (let idx=0;idx<res1.snapshotLength;idx++){
-                key = res2.snapshotItem(idx).textContent;
-                val = res1.snapshotItem(idx).value
-                dct[key] = val;
-            }
 
-            return JSON.stringify(dct)
-            })();""",
-            0,
-            self.getFilteredKeys,
-        )
+class ParCoordWidget(ParCoordBase, QtWidgets.QWidget):
+    selectionchanged = QtCore.Signal(list)
+    datachanged = QtCore.Signal()
+    dataupdated = QtCore.Signal(list, list, list)
+
+    def __init__(self):
+        super().__init__()
+        QtWebEngineWidgets, QtWebChannel = webEngine()
+        self.view = QtWebEngineWidgets.QWebEngineView()
+        la = QtWidgets.QVBoxLayout()
+        la.setContentsMargins(0, 0, 0, 0)
+        la.addWidget(self.view)
+        self.setLayout(la)
+
+        self.td = tempfile.TemporaryDirectory()
+        self.tempfile = self.td.name + "/tmp.html"
+        self.view.loadFinished.connect(self.onloadFinished)
+        self._page = self.view.page()
+        self.bridge = BrushBridge(self.getFilteredKeys)
+        self.channel = QtWebChannel.QWebChannel()
+        self.channel.registerObject("bridge", self.bridge)
+        self._page.setWebChannel(self.channel)
+
+        # the page is loaded once, data is pushed to it when it is ready
+        self.loaded = False
+        self.pending = None
+        layout = go.Layout(template="plotly_dark").to_plotly_json()
+        html = PAGE.replace("%PLOTLYJS%", plotlyBundle(self.td.name).as_uri())
+        html = html.replace("%LAYOUT%", json.dumps(layout, cls=PlotlyJSONEncoder))
+        open(self.tempfile, "w", encoding="utf-8").write(html)
+        url = QtCore.QUrl.fromLocalFile(str(Path(self.tempfile).resolve()))
+        self.view.load(url)
+
+    def showData(self):
+        # rows are sorted by the first column, which is also the color
+        meta = self.meta
+        order = np.argsort(meta[meta.columns[0]].values)
+        cs = getattr(pcol.sequential, self.csname)
+        colorscale = [[pos, col] for pos, col in zip(np.linspace(0, 1, len(cs)), cs)]
+        dims = []
+        for k in meta.columns:
+            vals = meta[k].values[order]
+            dim = dict(label=k, values=encodeArray(vals), range=self.minmax[k][:2])
+            if k in self.filter.lims:
+                dim["constraintrange"] = list(self.filter.lims[k])
+            dims.append(dim)
+        color = encodeArray(meta[meta.columns[0]].values[order])
+        payload = dict(dims=dims, color=color, colorscale=colorscale)
+        self.pending = json.dumps(payload, cls=PlotlyJSONEncoder)
+        if self.loaded:
+            self.pushData()
+
+    def pushData(self):
+        payload, self.pending = self.pending, None
+        self._page.runJavaScript(f"setData({payload});")
 
     def onloadFinished(self, _):
-        self.timer.start()
+        self.loaded = True
+        if self.pending is not None:
+            self.pushData()
+
+
+class NativeParCoordWidget(ParCoordBase, pg.GraphicsLayoutWidget):
+    # parcoords drawn with pyqtgraph. all polylines are drawn by a few plot items:
+    # one for the filtered out lines, and one per color bin for the selected ones.
+    # every axis has a region item for brushing.
+    # above DENSITYTHRESHOLD rows, the lines are aggregated: every pair of adjacent
+    # axes is binned into a 2d histogram, and each bin with data is drawn as one
+    # segment, shaded by its count. the selection is drawn the same way, or as
+    # polylines if it has at most DENSITYLINES rows.
+    selectionchanged = QtCore.Signal(list)
+    datachanged = QtCore.Signal()
+    dataupdated = QtCore.Signal(list, list, list)
+
+    def __init__(self):
+        super().__init__()
+        self.bridge = BrushBridge(self.getFilteredKeys)
+        self.plt = self.addPlot()
+        self.plt.setMouseEnabled(False, False)
+        self.plt.setMenuEnabled(False)
+        self.plt.hideButtons()
+        self.plt.hideAxis("left")
+        self.regions = []
+        self.lines = []
+        self.densityItems = []
+        self.selectionchanged.connect(self.updateSelection)
+
+    def showData(self):
+        plt = self.plt
+        plt.clear()
+        cols = self.meta.columns
+        ndims = len(cols)
+
+        # every row is a polyline through all axes, axes are scaled to 0..1
+        self.norm = norm = np.empty((len(self.meta), ndims))
+        for idx, col in enumerate(cols):
+            minval, _, span = self.minmax[col]
+            norm[:, idx] = (self.meta[col].values - minval) / span
+        self.density = len(norm) > DENSITYTHRESHOLD
+
+        colorvals = self.meta[self.colormapkey].values
+        bins = (colorvals - self.minmax[self.colormapkey][0]) / (
+            self.minmax[self.colormapkey][2]
+        )
+        bins = np.clip((bins * COLORBINS).astype(int), 0, COLORBINS - 1)
+        colors = self.colormap.map((np.arange(COLORBINS) + 0.5) / COLORBINS, "qcolor")
+
+        if self.density:
+            self.cells = self.densityCells(norm)
+            alphas = np.linspace(40, 255, DENSITYLEVELS).astype(int)
+            grays = [plt.plot(pen=pg.mkPen(128, 128, 128, x)) for x in alphas]
+            self.drawDensity(grays, np.ones(len(norm), dtype=bool))
+        else:
+            x, y, connect = self.polylines(np.arange(len(norm)))
+            plt.plot(x=x, y=y, connect=connect, pen=pg.mkPen(128, 128, 128, 40))
+
+        self.lines = []
+        for colorbin in np.unique(bins):
+            members = np.flatnonzero(bins == colorbin)
+            self.lines.append((plt.plot(pen=colors[colorbin]), members))
+        self.densityItems = []
+        if self.density:
+            levels = self.colormap.map(
+                (np.arange(DENSITYLEVELS) + 0.5) / DENSITYLEVELS, "qcolor"
+            )
+            self.densityItems = [plt.plot(pen=x) for x in levels]
+
+        self.regions = []
+        for idx, col in enumerate(cols):
+            center = (idx + 0.5) / ndims
+            region = pg.LinearRegionItem(
+                (0, 1),
+                orientation="horizontal",
+                bounds=(0, 1),
+                span=(center - 0.1 / ndims, center + 0.1 / ndims),
+            )
+            if col in self.filter.lims:
+                minval, _, span = self.minmax[col]
+                lim = np.array(self.filter.lims[col])
+                region.setRegion(np.clip((lim - minval) / span, 0, 1))
+            region.sigRegionChanged.connect(self.regionChanged)
+            plt.addItem(region)
+            self.regions.append(region)
+            for val, anchor in ((0, (0.5, 0)), (1, (0.5, 1))):
+                label = pg.TextItem(f"{self.minmax[col][val]:.4g}", anchor=anchor)
+                label.setPos(idx, val)
+                plt.addItem(label)
+
+        plt.getAxis("bottom").setTicks([list(enumerate(cols))])
+        plt.setXRange(-0.5, ndims - 0.5, padding=0)
+        plt.setYRange(0, 1, padding=0.08)
+        self.updateSelection()
+
+    def polylines(self, rows):
+        ndims = self.norm.shape[1]
+        x = np.tile(np.arange(ndims, dtype=float), len(rows))
+        y = self.norm[rows].ravel()
+        connect = np.ones(len(y), dtype=bool)
+        connect[ndims - 1 :: ndims] = False
+        return x, y, connect
+
+    @staticmethod
+    def densityCells(norm):
+        # the histogram cell of every row for every pair of adjacent axes, -1 for NaN
+        binned = np.clip((norm * DENSITYBINS).astype(int), 0, DENSITYBINS - 1)
+        cells = binned[:, :-1] * DENSITYBINS + binned[:, 1:]
+        invalid = np.isnan(norm)
+        cells[invalid[:, :-1] | invalid[:, 1:]] = -1
+        return cells
+
+    def drawDensity(self, items, mask):
+        # one segment per histogram cell with data, the items are ordered by count
+        cells = self.cells[mask]
+        center = (np.arange(DENSITYBINS) + 0.5) / DENSITYBINS
+        segments = [[] for _ in items]
+        counts = []
+        for pair in range(cells.shape[1]):
+            valid = cells[:, pair]
+            counts.append(np.bincount(valid[valid >= 0], minlength=DENSITYBINS ** 2))
+        maxcount = max([x.max() for x in counts] + [1])
+        for pair, count in enumerate(counts):
+            cellnos = np.flatnonzero(count)
+            levels = np.log1p(count[cellnos]) / np.log1p(maxcount) * len(items)
+            levels = np.clip(np.ceil(levels).astype(int) - 1, 0, len(items) - 1)
+            for level, segs in enumerate(segments):
+                segs.append((pair, cellnos[levels == level]))
+
+        for item, segs in zip(items, segments):
+            xs, ys = [np.empty(0)], [np.empty(0)]
+            for pair, cellnos in segs:
+                xs.append(pair + np.tile([0.0, 1.0], len(cellnos)))
+                starts = center[cellnos // DENSITYBINS]
+                ends = center[cellnos % DENSITYBINS]
+                ys.append(np.column_stack((starts, ends)).ravel())
+            item.setData(x=np.concatenate(xs), y=np.concatenate(ys), connect="pairs")
+
+    def regionChanged(self, _=None):
+        # regions that cover a whole axis dont filter it
+        lims = {}
+        for region, col in zip(self.regions, self.meta.columns):
+            start, end = region.getRegion()
+            if start <= 0 and end >= 1:
+                continue
+            minval, _, span = self.minmax[col]
+            lims[col] = [minval + start * span, minval + end * span]
+        self.bridge.brushed(lims)
+
+    def updateSelection(self, _=None):
+        mask = self.filter.mask
+        aggregate = self.density and mask.sum() > DENSITYLINES
+        if self.density:
+            self.drawDensity(self.densityItems, mask if aggregate else [])
+        for item, members in self.lines:
+            rows = [] if aggregate else members[mask[members]]
+            x, y, connect = self.polylines(rows)
+            item.setData(x=x, y=y, connect=connect)
+
+
+PARCOORDBACKENDS = {"web": ParCoordWidget, "native": NativeParCoordWidget}
@@ -1,71 +1,115 @@
+import hashlib
 import itertools as itt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from scipy import signal
 
 from parcoords import dataAnalysis
+from parcoords import log as logging
+
+log = logging.getLogger()
 
-DBG_NOCACHE = 0
 TMPPATH = "tmp/example.h5"
+EXAMPLEVERSION = 2  # bump to rebuild cached example data after changes here
+CHUNKSIZE = 100  # (omega, zeta) pairs computed per batch
+EXAMPLECHARACTERISTICS = ("os", "tr", "tm")  # see dataAnalysis.stepCharacteristics
 
 
-def getExampleData():
+def getExampleData(nomega=10, nzeta=10, samples=100, nparams=0, workers=1):
     # implements: e2
-    global DBG_NOCACHE
+    # the example data is cached in TMPPATH. it is rebuilt if it was created with
+    # other parameters (workers do not change the data)
+    params = (EXAMPLEVERSION, nomega, nzeta, samples, nparams)
+    tag = hashlib.sha1(repr(params).encode()).hexdigest()
     p = Path(TMPPATH)
-    if DBG_NOCACHE:
-        p.unlink(missing_ok=True)
-        DBG_NOCACHE = False
     if p.is_file():
-        return p
+        with pd.HDFStore(p, mode="r") as store:
+            if getattr(store._handle.root._v_attrs, "parcoords_example", None) == tag:
+                return p
 
     p.parent.mkdir(parents=True, exist_ok=True)
-    bufferdict = {}
-    for key, df in createExampleData():
-        bufferdict[key] = df
-    dataAnalysis.dict2h5(bufferdict, p)
-    return getExampleData()
-
-
-def createExampleData():
-    omegas = np.linspace(1, 10, 10)
-    zetas = np.linspace(0, 2, 10)
-    params = tuple(itt.product(omegas, zetas))
+    data = createExampleData(nomega, nzeta, samples, nparams, workers)
+    dataAnalysis.iter2h5(data, p, mode="w")
+    with pd.HDFStore(p) as store:
+        store._handle.root._v_attrs.parcoords_example = tag
+    return p
+
+
+def createExampleData(nomega=10, nzeta=10, samples=100, nparams=0, workers=1):
+    # step responses of second order systems on a grid of omega x zeta. the pairs
+    # are computed in batches of CHUNKSIZE, spread over workers processes, and
+    # yielded in grid order. nparams adds random in_p* parameters to the metadata
+    omegas = np.linspace(1, 10, nomega)
+    zetas = np.linspace(0, 2, nzeta)
+    params = np.array(tuple(itt.product(omegas, zetas))).reshape(-1, 2)
+    extra = np.random.default_rng(0).random((len(params), nparams))
     L = len(params)
-
+    chunks = (
+        (start, params[start : start + CHUNKSIZE], extra[start : start + CHUNKSIZE])
+        for start in range(0, L, CHUNKSIZE)
+    )
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from responseChunk(*chunk, samples)
+            log.debug(f"calculated {min(chunk[0] + CHUNKSIZE, L)}/{L} responses")
+        return
+
+    # only a few chunks are in flight, so the results do not pile up in memory
+    # if the consumer is slower than the workers
+    with ProcessPoolExecutor(workers) as pool:
+        futures = deque()
+        for chunk in chunks:
+            futures.append(pool.submit(responseChunk, *chunk, samples))
+            if len(futures) >= 2 * workers:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
+
+
+def responseChunk(start, params, extra, samples):
+    t, y = stepResponses(params[:, 0], params[:, 1], samples)
+    offsets = np.arange(len(params) + 1) * samples
+    outs = dataAnalysis.stepCharacteristics(
+        t.ravel(), y.ravel(), offsets, names=EXAMPLECHARACTERISTICS
+    )
+    frames = []
     for idx, (omega, zeta) in enumerate(params):
-        print(f"calculating step {idx+1}/{L} for omega={omega}, zeta={zeta}")
-        num = [omega ** 2]
-        denum = [1, 2 * zeta * omega, omega ** 2]
-
-        tf = signal.TransferFunction(num, denum)
-        t, y = tf.step()
-
-        df = pd.DataFrame({"t": t, "y": y})
+        df = pd.DataFrame({"t": t[idx], "y": y[idx]})
         df.set_index("t", inplace=True)
 
         df.attrs["in_omega"] = omega
         df.attrs["in_zeta"] = zeta
-
-        calculateeCharacteristics(df)
-
-        yield f"d{idx}", df
-
-
-def calculateeCharacteristics(df):
-    os = max(0, max(df["y"]) - 1)
-    tr = df["y"] > 0.95
-
-    tm = tr & (df["y"] < 1.05)
-    inversetm = tm.iloc[::-1]
-    lastNotInMargin = inversetm.idxmin()
-    if lastNotInMargin == inversetm.index[0]:
-        tm = -10
-    else:
-        tm = lastNotInMargin
-
-    df.attrs["out_os"] = os
-    df.attrs["out_tr"] = tr.idxmax()
-    df.attrs["out_tm"] = tm
+        for no, val in enumerate(extra[idx]):
+            df.attrs[f"in_p{no}"] = val
+
+        for name, vals in outs.items():
+            df.attrs[f"out_{name}"] = vals[idx]
+
+        frames.append((f"d{start + idx}", df))
+    return frames
+
+
+def stepResponses(omega, zeta, samples):
+    # analytic step responses of omega**2 / (s**2 + 2*zeta*omega*s + omega**2), for
+    # arrays of omega and zeta at once. the time axes are the ones that
+    # scipy.signal.step would choose: 7 times the slowest time constant.
+    omega = np.asarray(omega, dtype=float)[:, None]
+    zeta = np.asarray(zeta, dtype=float)[:, None]
+    root = np.sqrt(zeta ** 2 - 1 + 0j)
+    s1 = omega * (-zeta + root)
+    s2 = omega * (-zeta - root)
+    r = np.minimum(abs(s1.real), abs(s2.real))
+    r[r == 0] = 1.0
+    t = np.linspace(0, 7 / r[:, 0], samples, axis=1)
+
+    critical = np.isclose(zeta[:, 0], 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = 1 + (s2 * np.exp(s1 * t) - s1 * np.exp(s2 * t)) / (s1 - s2)
+    y = y.real
+    wt = omega[critical] * t[critical]
+    y[critical] = 1 - np.exp(-wt) * (1 + wt)
+    return t, y
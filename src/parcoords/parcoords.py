@@ -1,4 +1,5 @@
 import argparse
+import os
 from pathlib import Path
 
 from . import __metadata__
@@ -11,7 +12,48 @@ def parseArgs(argv):
     p.add_argument("-?", action="store_true", help="show this help message and exit")
     p.add_argument("-v", "--version", action="store_true", help="prints version")
     p.add_argument(
-        "-src", type=Path, help="data src path. pass '#example' to show example data"
+        "-src",
+        type=Path,
+        help="data src path, a file, directory or glob. "
+        "pass '#example' to show example data",
+    )
+    p.add_argument(
+        "-backend",
+        choices=["web", "native"],
+        default="web",
+        help="draw the parcoords with plotly (web) or pyqtgraph (native)",
+    )
+    p.add_argument(
+        "-cache",
+        action="store_true",
+        help="map the data of the src file from a cache folder next to it. "
+        "the cache is rebuilt when the src file changes",
+    )
+    p.add_argument(
+        "-workers",
+        type=int,
+        help="processes that read the src file when the cache is built",
+    )
+    p.add_argument(
+        "-persist",
+        action="store_true",
+        help="write the results of the calculations back into the src file(s), "
+        "so they are not calculated again on the next start",
+    )
+    p.add_argument(
+        "-watch",
+        action="store_true",
+        help="show runs that are added to the src while the viewer is open",
+    )
+    p.add_argument(
+        "-query",
+        help="only show the runs whose metadata match this expression, "
+        "ie 'in_omega > 2 & out_os in [0, 1]'",
+    )
+    p.add_argument(
+        "-reindex",
+        action="store_true",
+        help="(re)write the metadata index of the src file(s) and exit",
     )
 
     args = vars(p.parse_args(argv))
@@ -29,9 +71,33 @@ def main(argv=None):
         parser.print_help()
         return 0
 
+    if args["watch"]:
+        # the viewer only opens the src files while it reads them, and must not lock
+        # them then, or the writer would fail. hdf5 reads this when it is loaded, so
+        # before the first import
+        os.environ.setdefault("HDF5_USE_FILE_LOCKING", "FALSE")
+
     from parcoords import api
 
-    data = api.read(args["src"])
-    api.show(data)
+    if args["reindex"]:
+        api.upgrade(args["src"])
+        return 0
+
+    if args["query"]:
+        data = api.query(args["src"], args["query"])
+        if not len(data):
+            data.close()
+            print(f"no runs match {args['query']!r}")
+            return 1
+    else:
+        data = api.read(
+            args["src"],
+            progressive=True,
+            cache=args["cache"],
+            workers=args["workers"],
+            persist=args["persist"],
+        )
+    with data:
+        api.show(data, backend=args["backend"], watch=args["watch"])
 
     return 0
@@ -1,23 +1,31 @@
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pyqtgraph as pg
 import pytest
-from pyqtgraph.Qt import QtWidgets
+from pyqtgraph.Qt import QtCore, QtWidgets
 
-from parcoords import api, dataVisualisation, exampledata, log
+from parcoords import api, dataAnalysis, dataVisualisation, exampledata, log
 from parcoords import parcoords as module
 
-exampledata.DBG_NOCACHE = True
 dataVisualisation.DBG_DONTBLOCK = True
 
 
 def test_visualizeExamples(tmpdir, qtbot):
     exampledata.TMPPATH = str(tmpdir / "tmp.h5")
 
+    # add some uniusable metadata for coverage
+    with pd.HDFStore(exampledata.getExampleData()) as store:
+        md = store.get_storer("/d0").attrs.metadata
+        md["unusable"] = {"bla": 1, "blubb": [2, 3]}
+        store.get_storer("/d0").attrs.metadata = md
+        dataAnalysis.writeMetaIndex(store)
+
     # proofs: c1, e1, f1, e2, f2, e3
     with api.read("#example") as data:
-
-        # add some uniusable metadata for coverage
-        md = data.get_storer("/d0").attrs.metadata
-        md["unusable"] = {"bla": 1, "blubb": [2, 3]}
-        data.get_storer("/d0").attrs.metadata = md
+        assert "unusable" in data.get_storer("/d0").attrs.metadata
 
         # proofs: c2, e5, f3, f4, e4
         win = dataVisualisation.mkgui()
@@ -29,11 +37,416 @@ def test_visualizeExamples(tmpdir, qtbot):
         qtbot.waitSignal(win.parcoords.plts.finished, timeout=10000)
         win.parcoords.plts.filt = ["/d0"]
         win.parcoords.pc.onloadFinished(0)
+        assert win.parcoords.pc.pending is None
+        # once the page is loaded, new data is pushed without reloading it
+        win.parcoords.setParcoordData(data)
+        assert win.parcoords.pc.pending is None
         win.parcoords.pc.getFilteredKeys()
-        win.parcoords.pc.getFilteredKeys('{"in_omega": "0.25,0.75,0.5"}')
+        win.parcoords.pc.getFilteredKeys('{"in_omega": [2.5, 7.5]}')
         win.parcoords.plts.updatePlots(None)
         win.parcoords.plts.updatePlots(win.parcoords.plts.filt)
-        win.parcoords.pc.getFilteredKeys('{"in_omega": "0,1"}')
+        win.parcoords.pc.getFilteredKeys('{"in_omega": null}')
+
+        # brush events are pushed by the page, bursts are coalesced
+        with qtbot.waitSignal(win.parcoords.pc.selectionchanged) as blocker:
+            win.parcoords.pc.bridge.brushed('{"in_omega": [1, 2]}')
+            win.parcoords.pc.bridge.brushed('{"in_omega": [1, 1.5]}')
+        assert blocker.args[0] == [f"/d{x}" for x in range(10)]
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_packedPlots(tmpdir, qtbot, monkeypatch, packed):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+    monkeypatch.setattr(dataVisualisation, "PACKTHRESHOLD", 10)
+
+    with api.read("#example", packed=packed) as data:
+        win = dataVisualisation.mkgui()
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        plts = win.parcoords.plts
+        assert not plts.pltLines
+
+        def npoints():
+            xs = (item.xData for item, *_ in plts.packs)
+            return sum(len(x) for x in xs if x is not None)
+
+        assert 1 < len(plts.packs) <= dataVisualisation.COLORBINS
+
+        plts.updatePlots(["/d0", "/d1"])
+        assert npoints() == len(data["/d0"]) + len(data["/d1"])
+        plts.updatePlots(None)
+        assert npoints() == sum(len(x) for x in data.values())
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_envelopePlots(tmpdir, qtbot, packed):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+
+    with api.read("#example", packed=packed) as data:
+        win = dataVisualisation.mkgui()
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        plts = win.parcoords.plts
+        plts.sel.setCurrentText("y")
+        plts.bandview.setChecked(True)
+        assert not plts.pltLines
+        assert len(plts.bands) == len(dataVisualisation.ENVELOPEPERCENTILES) + 1
+
+        grid = plts.buffers["y"]["envelope"]["grid"]
+
+        def resampled(keys):
+            ys = []
+            for k in keys:
+                df = data[k]
+                y = np.interp(grid, df.index.values, df["y"].values)
+                y[grid > df.index.values[-1]] = np.nan
+                ys.append(y)
+            return np.array(ys)
+
+        # min/max band and median of the whole data
+        keys = ["/d0", "/d5", "/d9"]
+        ys = resampled(data)
+        (lo, hi), median = plts.bands[0], plts.median
+        assert np.allclose(lo.yData, np.nanmin(ys, axis=0))
+        assert np.allclose(hi.yData, np.nanmax(ys, axis=0))
+        assert np.allclose(median.yData, np.nanmedian(ys, axis=0))
+
+        values = plts.buffers["y"]["envelope"]["values"]
+        plts.updatePlots(keys)
+        ys = resampled(keys)
+        ys = ys[:, ~np.isnan(ys).all(axis=0)]
+        assert np.allclose(median.yData, np.nanmedian(ys, axis=0))
+        assert np.allclose(plts.bands[0][1].yData, np.nanmax(ys, axis=0))
+
+        # the resampled column is cached, redrawing does not resample it
+        plts.drawplt()
+        assert plts.buffers["y"]["envelope"]["values"] is values
+        assert np.allclose(plts.median.yData, np.nanmedian(ys, axis=0))
+
+        plts.updatePlots([])
+        assert plts.median.yData is None or not len(plts.median.yData)
+        plts.updatePlots(None)
+        plts.bandview.setChecked(False)
+        assert plts.bands is None
+        assert len(plts.pltLines) == len(data)
+
+
+@pytest.mark.parametrize("packthreshold", [200, 10])
+def test_columnCache(qtbot, monkeypatch, packthreshold):
+    monkeypatch.setattr(dataVisualisation, "PACKTHRESHOLD", packthreshold)
+    data = {}
+    for idx in range(20):
+        t = np.linspace(0, 1, 50 + idx)
+        df = pd.DataFrame({"y": t * idx, "z": -t * idx}, index=pd.Index(t, name="t"))
+        df.attrs = {"in_idx": idx, "in_half": idx // 2}
+        data[f"/d{idx}"] = df
+
+    win = dataVisualisation.mkgui()
+    qtbot.addWidget(win)
+    win.parcoords.setParcoordData(data)
+    plts = win.parcoords.plts
+    reads = []
+
+    def seriesData(key, col):
+        reads.append((key, col))
+        return dataVisualisation.FilteredPlots.seriesData(plts, key, col)
+
+    monkeypatch.setattr(plts, "seriesData", seriesData)
+
+    def shown():
+        if plts.packs is None:
+            return set(k for k, v in plts.pltLines.items() if v.isVisible())
+        keys = set(k for k, pos in plts.keypos.items() if plts.selected[pos])
+        xs = (item.xData for item, *_ in plts.packs)
+        npoints = sum(len(x) for x in xs if x is not None)
+        assert npoints == sum(len(data[k]) for k in keys)
+        return keys
+
+    keys = [f"/d{idx}" for idx in range(0, 20, 3)]
+    plts.updatePlots(keys)
+    assert shown() == set(keys)
+    plts.sel.setCurrentText("z")
+    assert len(reads) == 20
+    assert shown() == set(keys)
+    plts.updatePlots(keys[1:] + ["/d1"])
+    assert shown() == set(keys[1:] + ["/d1"])
+
+    # both columns are cached, unless they exceed the memory cap. the buffers are
+    # copies, not views into the frames
+    plts.sel.setCurrentText("y")
+    assert len(reads) == 20
+    assert shown() == set(keys[1:] + ["/d1"])
+    for xy in plts.buffers["y"]["lines"].values():
+        assert all(x.base is None for x in xy)
+    monkeypatch.setattr(dataVisualisation, "PLOTCACHESIZE", 0)
+    plts.sel.setCurrentText("z")
+    assert list(plts.buffers) == []
+    assert shown() == set(keys[1:] + ["/d1"])
+    plts.sel.setCurrentText("y")
+    assert len(reads) == 40
+
+
+def test_lodPlots(tmpdir, qtbot, monkeypatch):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+    monkeypatch.setattr(dataVisualisation, "LODTHRESHOLD", 10)
+
+    with api.read("#example") as data:
+        win = dataVisualisation.mkgui()
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        plts = win.parcoords.plts
+        assert len(plts.lodLines) == len(data)
+
+        t = data["/d0"].index.values
+        plts.p1.setXRange(t[10], t[20], padding=0)
+        plts.updateLOD()
+        x = plts.lodLines["/d0"].xData
+        assert x[0] <= t[10] and x[-1] >= t[20] and len(x) < len(t)
+
+
+def test_nativeBackend(tmpdir, qtbot):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+
+    with api.read("#example") as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        pc = win.parcoords.pc
+        assert isinstance(pc, dataVisualisation.NativeParCoordWidget)
+        assert len(pc.regions) == len(pc.meta.columns)
+
+        def nlines():
+            xs = (item.xData for item, *_ in pc.lines)
+            return sum(len(x) for x in xs if x is not None) / len(pc.meta.columns)
+
+        assert nlines() == len(data)
+
+        # brushing the lower half of in_omega
+        idx = list(pc.meta.columns).index("in_omega")
+        with qtbot.waitSignal(pc.selectionchanged) as blocker:
+            pc.regions[idx].setRegion((0, 0.5))
+        expected = pc.meta.index[pc.meta["in_omega"] <= 5.5]
+        assert blocker.args[0] == list(expected)
+        assert nlines() == len(expected)
+        assert win.parcoords.plts.filt == list(expected)
+
+
+def test_nativeWithoutWebEngine():
+    # the native backend must work on systems without chromium
+    code = (
+        "import sys; from pyqtgraph.Qt import QtCore;"
+        "sys.modules[QtCore.__name__.replace('QtCore', 'QtWebEngineWidgets')] = None;"
+        "from parcoords import dataVisualisation as dv;"
+        "w = dv.mkgui(backend='native'); assert w.parcoords.pc is not None"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_listDock(tmpdir, qtbot):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+
+    with api.read("#example") as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        pc = win.parcoords.pc
+        ld = win.parcoords.ld
+        mdl = ld.mdl
+        assert mdl.rowCount() == 100
+        assert mdl.columnCount() == 2 + len(pc.meta.columns)
+        assert mdl.data(mdl.index(3, 1)) == "/d3"
+
+        col = 2 + list(pc.meta.columns).index("out_tr")
+        ld.view.sortByColumn(col, QtCore.Qt.DescendingOrder)
+        tr = [float(mdl.data(mdl.index(x, col))) for x in range(100)]
+        assert tr == sorted(tr, reverse=True)
+        assert mdl.keyAt(0) == pc.meta["out_tr"].idxmax()
+
+        with qtbot.waitSignal(pc.selectionchanged):
+            pc.getFilteredKeys({"in_omega": [1, 2]})
+        assert mdl.rowCount() == 100
+        ld.onlySelected.setChecked(True)
+        assert mdl.rowCount() == 20
+        keys = [mdl.keyAt(x) for x in range(20)]
+        assert set(keys) == set(pc.meta.index[pc.meta["in_omega"] <= 2])
+        tr = [float(mdl.data(mdl.index(x, col))) for x in range(20)]
+        assert tr == sorted(tr, reverse=True)
+
+        with qtbot.waitSignal(ld.selectionChanged) as blocker:
+            ld.view.setCurrentIndex(mdl.index(0, 1))
+        assert blocker.args == [keys[0]]
+
+
+def test_statsDocks(tmpdir, qtbot, monkeypatch):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+    monkeypatch.setattr(dataVisualisation, "BARTHRESHOLD", 30)
+    monkeypatch.setattr(dataVisualisation, "BARGROUPS", 10)
+
+    with api.read("#example") as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        sw = win.parcoords.statswidget
+        pc = win.parcoords.pc
+        sw.HistDock.sel.setCurrentText("in_omega")
+
+        def bars(plt):
+            return [x for x in plt.items if isinstance(x, pg.BarGraphItem)]
+
+        # all datasets: aggregated bars, the selection covers the full histogram
+        assert "100/100 datasets selected" in sw.table.toPlainText()
+        assert sw.HistDock.selbars.opts["height"].sum() == 100
+        (p1, _), (p2, _) = sw.BarDock.plots
+        assert len(bars(p1)[0].opts["x"]) == 10
+        assert bars(p2)
+
+        with qtbot.waitSignal(pc.selectionchanged):
+            pc.getFilteredKeys({"in_omega": [1, 2]})
+        assert "20/100 datasets selected" in sw.table.toPlainText()
+        assert sw.HistDock.selbars.opts["height"].sum() == 20
+        item = bars(p1)[0]
+        assert list(item.opts["x"]) == list(sw.rows)
+        col = sw.BarDock.sel.currentText()
+        assert list(item.opts["height"]) == list(pc.meta[col].values[sw.rows])
+
+        # the docks keep their columns and the selection when the data changes
+        sw.BarDock.sel.setCurrentText("in_zeta")
+        pc.updateData()
+        assert sw.BarDock.sel.currentText() == "in_zeta"
+        assert len(sw.rows) == 20
+
+        # a closed window does not follow the selection anymore
+        win.close()
+        pc.selectionchanged.emit([])
+        assert len(sw.rows) == 20
+
+
+def test_showQuery(tmpdir, qtbot):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+
+    with api.query("#example", "in_omega <= 2 & out_os > 0") as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        win.parcoords.loadData(data)
+        assert len(win.parcoords.pc.meta) == len(data) < 20
+        assert set(win.parcoords.plts.pltLines) == set(data)
+
+    # no runs, or a single one, leave nothing to show
+    for expr, n in (("in_omega > 100", 0), ("in_omega == 1 & in_zeta == 0", 1)):
+        with api.query("#example", expr) as data:
+            assert len(data) == n
+            win = dataVisualisation.mkgui(backend="native")
+            qtbot.addWidget(win)
+            win.parcoords.loadData(data)
+            assert not hasattr(win.parcoords.pc, "meta")
+
+
+def test_watchMode(tmpdir, qtbot):
+    path = str(tmpdir / "watched.h5")
+    frames = list(exampledata.createExampleData(3, 3, samples=20))
+    dataAnalysis.iter2h5(frames[:6], path)
+
+    with api.read(path) as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        area = win.parcoords
+        area.setParcoordData(data)
+        pc = area.pc
+        rebuilds = []
+        pc.datachanged.connect(lambda: rebuilds.append(1))
+        idx = list(pc.meta.columns).index("in_omega")
+        with qtbot.waitSignal(pc.selectionchanged):
+            pc.regions[idx].setRegion((0, 0.5))
+        lims = dict(pc.filter.lims)
+        area.watch(interval=10 ** 6)
+        area.checkSource()
+        assert len(pc.meta) == 6
+
+        # the farm appends runs, reruns d1 and drops d2, with plain pandas. the
+        # viewer has no handle open between its reads
+        assert not data.store.is_open
+        changed = frames[1][1].copy()
+        changed.attrs["in_zeta"] = 0.5
+        with pd.HDFStore(path) as store:
+            for key, df in frames[6:] + [("d1", changed)]:
+                store.put(key, df)
+                store.get_storer(key).attrs.metadata = df.attrs
+            store.remove("/d2")
+
+        with qtbot.waitSignal(pc.dataupdated) as blocker:
+            area.checkSource()
+        assert blocker.args == [["/d6", "/d7", "/d8"], ["/d1"], ["/d2"]]
+        assert not rebuilds
+        assert len(pc.meta) == 8 and pc.meta.loc["/d1", "in_zeta"] == 0.5
+        # the brush stays where it was in data units
+        assert pc.filter.lims == lims
+        assert pc.regions[idx].getRegion()[1] == pytest.approx((3.25 - 1) / 9)
+        assert area.ld.mdl.rowCount() == 8
+        assert set(area.plts.pltLines) == set(data)
+        assert area.plts.pltLines["/d7"].isVisible() == ("/d7" in area.plts.filt)
+        assert area.checkSource() is None
+
+        area.stopLoading()
+        assert area.watcher is None
+
+
+def test_nativeDensity(tmpdir, qtbot, monkeypatch):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+    monkeypatch.setattr(dataVisualisation, "DENSITYTHRESHOLD", 50)
+    monkeypatch.setattr(dataVisualisation, "DENSITYLINES", 20)
+
+    with api.read("#example") as data:
+        win = dataVisualisation.mkgui(backend="native")
+        qtbot.addWidget(win)
+        win.parcoords.setParcoordData(data)
+        pc = win.parcoords.pc
+        assert pc.density
+
+        def npoints(items):
+            return sum(len(x.xData) for x in items if x.xData is not None)
+
+        def nsegments():
+            return npoints(pc.densityItems) // 2
+
+        # all 100 rows are aggregated into at most one segment per row and pair
+        npairs = len(pc.meta.columns) - 1
+        assert 0 < nsegments() <= 100 * npairs
+        assert npoints(item for item, _ in pc.lines) == 0
+
+        # small selections are drawn as lines
+        pc.getFilteredKeys({"in_omega": [1, 1]})
+        assert nsegments() == 0
+        assert npoints(item for item, _ in pc.lines) == 10 * (npairs + 1)
+
+
+def test_progressiveLoading(tmpdir, qtbot, monkeypatch):
+    exampledata.TMPPATH = str(tmpdir / "tmp.h5")
+    monkeypatch.setattr(dataVisualisation, "LOADBATCH", 7)
+    with pd.HDFStore(exampledata.getExampleData()) as store:
+        store.remove(dataAnalysis.METAKEY)
+
+    loader = dataVisualisation.DataLoader(None, subsample=10)
+    chunks = [len(x) for x in loader.chunks(list(range(100)))]
+    assert chunks == [10, 20, 40, 30]
+
+    with api.read("#example", progressive=True) as data:
+        assert not data.complete and len(data) == 0
+        win = dataVisualisation.mkgui()
+        qtbot.addWidget(win)
+        # the chunks after the first one only add their keys
+        changes, updates = [], []
+        win.parcoords.pc.datachanged.connect(lambda: changes.append(len(data)))
+        win.parcoords.pc.dataupdated.connect(lambda *x: updates.append(x[0]))
+        with qtbot.waitSignals([win.parcoords.progress] * 3):
+            win.parcoords.loadData(data)
+        qtbot.waitUntil(lambda: data.complete, timeout=10000)
+        assert len(win.parcoords.pc.meta) == len(data) == 100
+        assert changes == [10, 100]
+        assert [len(x) for x in updates] == [20, 40, 30]
+        assert sum(updates, []) == list(data)[10:]
+        assert "loaded metadata of 100/100" in win.statusBar().currentMessage()
+        win.parcoords.stopLoading()
+        assert win.parcoords.loader is None
 
 
 def test_edgecases(monkeypatch):
@@ -49,3 +462,7 @@ def test_edgecases(monkeypatch):
         mp.setattr(QtWidgets.QMainWindow, "show", noop)
         mp.setattr(dataVisualisation.parCoordDockArea, "setParcoordData", noop)
         module.main(["-src", "#example"])
+        module.main(["-src", "#example", "-cache"])
+        module.main(["-src", "#example", "-watch"])
+        module.main(["-src", "#example", "-query", "in_omega < 3"])
+        assert module.main(["-src", "#example", "-query", "in_omega > 100"]) == 1
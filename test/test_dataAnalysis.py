@@ -0,0 +1,634 @@
+import multiprocessing
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from parcoords import dataAnalysis, exampledata
+
+
+def mkFrames(n=10, rows=100, offset=0):
+    for idx in range(offset, offset + n):
+        df = pd.DataFrame({"t": range(rows), "y": [float(idx)] * rows})
+        df.set_index("t", inplace=True)
+        df.attrs["in_idx"] = idx
+        df.attrs["in_half"] = idx / 2
+        yield f"d{idx}", df
+
+
+def mkStore(path, n=10, rows=100):
+    dct = dict(mkFrames(n, rows))
+    dct["empty"] = pd.DataFrame({"y": []})
+    dataAnalysis.dict2h5(dct, path)
+    return path
+
+
+def test_lazyLoading(tmpdir):
+    path = mkStore(str(tmpdir / "lazy.h5"))
+    # room for two frames only
+    with dataAnalysis.LazyDataDict(path, cachesize=2 * 1600) as data:
+        assert len(data) == 10
+        assert "/empty" not in data
+        assert len(data.cache) == 0
+
+        meta = dataAnalysis.getMetaMatrix(data)
+        assert list(meta.columns) == ["in_half", "in_idx"]
+        assert len(data.cache) == 0
+
+        assert data["/d3"]["y"].iloc[0] == 3.0
+        data["/d3"].attrs["out_calc"] = 1
+        data["/d4"]
+        data["/d5"]
+        assert list(data.cache) == ["/d4", "/d5"]
+        assert data["/d3"].attrs["out_calc"] == 1
+        assert data.cachedbytes <= data.cachesize
+
+        # a range of rows is read without loading the frame
+        rows = data.select("/d6", 10, 20)
+        assert list(rows.index) == list(range(10, 20)) and "/d6" not in data.cache
+        assert rows.attrs["in_idx"] == 6
+
+    assert len(data.cache) == 0
+
+
+def test_readExample(tmpdir):
+    exampledata.TMPPATH = str(tmpdir / "example.h5")
+    with dataAnalysis.read("#example") as data:
+        assert len(data) == 100
+        assert data["/d0"].attrs["in_omega"] == 1.0
+
+
+def test_metaIndex(tmpdir, monkeypatch):
+    path = mkStore(str(tmpdir / "index.h5"))
+    # an unchanged file is trusted without listing its nodes
+    with monkeypatch.context() as m:
+        m.setattr(dataAnalysis, "nodeStamp", None)
+        with dataAnalysis.LazyDataDict(path) as data:
+            assert data.index is not None
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is not None
+        assert list(data) == sorted(list(data), key=lambda x: int(x[2:]))
+        meta = dataAnalysis.getMetaMatrix(data)
+        assert meta.loc["/d4", "in_half"] == 2.0
+        assert not data.metadata
+
+        data["/d4"].attrs["in_half"] = 10
+        assert dataAnalysis.getMetaMatrix(data).loc["/d4", "in_half"] == 10
+
+    # a write that does not finish with a new index makes it stale
+    with pd.HDFStore(path) as store:
+        dataAnalysis.bumpGeneration(store)
+        store.put("new", pd.DataFrame({"y": [1.0]}))
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is None
+        assert "/new" in data
+
+    dataAnalysis.upgrade(path)
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is not None
+        assert "/new" in data
+        assert data.getattrs("/d1") == {"in_idx": 1, "in_half": 0.5}
+
+    # runs that other tools add or remove make the index stale, too
+    with pd.HDFStore(path) as store:
+        store.put("d10", pd.DataFrame({"y": [1.0]}))
+        store.get_storer("d10").attrs.metadata = {"in_idx": 10}
+        store.remove("d3")
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is None
+        assert "/d10" in data and "/d3" not in data
+        assert data.getattrs("/d10") == {"in_idx": 10}
+
+    # also in nested groups
+    nested = str(tmpdir / "nested.h5")
+    dataAnalysis.dict2h5(dict(mkFrames(3)), nested)
+    dataAnalysis.dict2h5(dict(("batch/" + k, v) for k, v in mkFrames(3)), nested)
+    with pd.HDFStore(nested) as store:
+        store.put("batch/d9", pd.DataFrame({"y": [1.0]}))
+        store.remove("batch/d0")
+    with dataAnalysis.LazyDataDict(nested) as data:
+        assert data.index is None
+        assert "/batch/d9" in data and "/batch/d0" not in data
+        assert "/d0" in data
+
+
+def test_query(tmpdir):
+    path = mkStore(str(tmpdir / "query.h5"))
+    keys = dataAnalysis.query(path, "2 <= in_idx < 7 & in_half not in [3]", False)
+    assert keys == ["/d2", "/d3", "/d4", "/d5"]
+
+    # the index is used, series are only read on access
+    with dataAnalysis.query(path, "in_idx in [1, 8] | in_half > 4") as sub:
+        assert list(sub) == ["/d1", "/d8", "/d9"]
+        assert not sub.data.cache and not sub.data.metadata
+        assert list(dataAnalysis.getMetaMatrix(sub)["in_idx"]) == [1, 8, 9]
+        assert sub["/d8"]["y"].iloc[0] == 8.0
+        assert sub.getattrs("/d9")["in_half"] == 4.5
+        assert "/d2" not in sub
+        with pytest.raises(KeyError):
+            sub["/d2"]
+    assert not sub.data.store.is_open
+
+    # an invalid expression does not leave the file open
+    with pytest.raises(SyntaxError):
+        dataAnalysis.query(path, "in_idx >")
+    with pd.HDFStore(path, "a") as store:
+        assert "/d0" in store
+
+    folder = tmpdir / "campaign"
+    folder.ensure(dir=True)
+    mkStore(str(folder / "b0.h5"), n=3)
+    mkStore(str(folder / "b1.h5"), n=4)
+    assert dataAnalysis.query(str(folder), "in_idx > 1", False) == [
+        "/b0/d2",
+        "/b1/d2",
+        "/b1/d3",
+    ]
+
+    with dataAnalysis.read(path) as data:
+        sub = dataAnalysis.query(data, "in_idx > 100")
+        assert len(sub) == 0
+        sub.close()
+        assert data.store.is_open
+        with pytest.raises(ValueError):
+            dataAnalysis.query(data, "in_idx + 1")
+
+
+def test_metaMatrix():
+    dfs = {}
+    for idx in range(4):
+        dfs[f"/d{idx}"] = df = pd.DataFrame({"y": [1.0]})
+        df.attrs = {"a": idx, "b": str(idx / 2), "c": [idx], "_d": idx}
+    dfs["/d1"].attrs["e"] = 1.5
+    dfs["/d2"].attrs["a"] = None
+    dfs["/d3"].attrs["c"] = {"x": 1}
+
+    meta = dataAnalysis.getMetaMatrix(dfs)
+    assert list(meta.columns) == ["a", "b", "e"]
+    assert list(meta.index) == list(dfs)
+    assert (meta.dtypes == float).all()
+    assert meta["b"].tolist() == [0.0, 0.5, 1.0, 1.5]
+    assert meta["a"].isna().tolist() == [False, False, True, False]
+    assert meta["e"].count() == 1
+
+
+def test_rangeFilter():
+    rng = np.random.default_rng(0)
+    meta = pd.DataFrame(rng.integers(0, 10, (1000, 3)), columns=["a", "b", "c"])
+    meta.index = [f"/d{x}" for x in meta.index]
+    flt = dataAnalysis.RangeFilter(meta)
+
+    def expected(lims):
+        df = meta
+        for k, (minv, maxv) in lims.items():
+            df = df[(df[k] >= minv) & (df[k] <= maxv)]
+        return list(df.index)
+
+    assert list(flt.getKeys({})) == list(meta.index)
+    for lims in (
+        {"a": (2, 5)},
+        {"a": (2, 5), "b": (0.5, 3)},
+        {"a": (2, 5), "b": (0.5, 7)},
+        {"b": (0.5, 7), "c": (9, 9)},
+        {"c": (11, 12)},
+    ):
+        assert list(flt.getKeys(lims)) == expected(lims)
+        assert set(flt.masks) == set(lims)
+
+    # only axes with changed limits are recomputed
+    flt.getKeys({"a": (2, 5), "b": (0, 1)})
+    mask = flt.masks["a"]
+    flt.getKeys({"a": (2, 5), "b": (0, 2)})
+    assert flt.masks["a"] is mask
+
+
+def test_metaStats():
+    rng = np.random.default_rng(0)
+    meta = pd.DataFrame(rng.random((1000, 2)), columns=["a", "b"])
+    meta.iloc[::7, 1] = np.nan
+    flt = dataAnalysis.RangeFilter(meta)
+    stats = dataAnalysis.MetaStats(meta, flt.sorted)
+    full, edges = stats.histogram("b")
+    assert full.sum() == meta["b"].count()
+    np.testing.assert_allclose(edges, np.histogram_bin_edges(meta["b"].dropna()))
+
+    for rows in (np.arange(1000), np.flatnonzero(flt.select({"a": (0.2, 0.5)})), [3]):
+        for col in ("a", "b"):
+            vals = meta[col].values[rows]
+            vals = vals[~np.isnan(vals)]
+            res = stats.describe(col, rows)
+            assert res[0] == len(vals)
+            np.testing.assert_allclose(
+                res[1:], [vals.min(), vals.max(), np.median(vals)]
+            )
+        counts, _ = stats.histogram("b", rows)
+        expected, _ = np.histogram(meta["b"].values[rows], edges)
+        np.testing.assert_array_equal(counts, expected)
+    assert stats.describe("b", [0, 7])[0] == 0
+
+
+def test_minMaxPyramid():
+    x = np.arange(10 ** 5) * 0.1
+    y = np.sin(x)
+    y[12345] = 5
+    loads = []
+
+    def loader(start, stop):
+        loads.append((start, stop))
+        return x[start:stop], y[start:stop]
+
+    pyr = dataAnalysis.MinMaxPyramid(x, y, loader)
+    assert len(pyr.levels[-1][0]) <= 1024
+
+    # the overview is decimated, but keeps the peaks
+    xs, ys = pyr.get(npoints=1000)
+    assert len(xs) <= 2000
+    assert ys.max() == 5 and ys.min() == y.min()
+    assert not loads
+
+    # zoomed in far enough, the full resolution of the range is loaded
+    xs, ys = pyr.get(1000, 1050, npoints=1000)
+    assert np.array_equal(xs, x[9999:10502])
+    assert np.array_equal(ys, y[9999:10502])
+    start, stop = loads[-1]
+    assert start <= 9999 and stop >= 10502 and stop - start < 1000
+
+
+def test_parallelRead(tmpdir, monkeypatch):
+    path = mkStore(str(tmpdir / "parallel.h5"), n=25)
+    serial = dataAnalysis.h52dict(path)
+    calls = []
+    parallel = dataAnalysis.h52dict(
+        path, workers=2, progress=lambda *x: calls.append(x)
+    )
+    assert list(parallel) == list(serial)
+    for key, df in serial.items():
+        pd.testing.assert_frame_equal(parallel[key], df)
+        assert parallel[key].attrs == df.attrs
+    assert calls[-1] == (26, 26)
+    assert [x[0] for x in calls] == sorted(x[0] for x in calls)
+
+    # packed and cached reads use the same path
+    packed = dataAnalysis.read(path, packed=True, workers=2)
+    cached = dataAnalysis.read(path, cache=True, workers=2)
+    for key, df in serial.items():
+        pd.testing.assert_frame_equal(packed[key], df, check_like=True)
+        pd.testing.assert_frame_equal(cached[key], df, check_like=True)
+
+    # dtypes that numpy does not know are kept
+    zoned = str(tmpdir / "zoned.h5")
+    frames = {}
+    for idx in range(4):
+        t = pd.date_range("2021-01-01", periods=5, freq="s", tz="Europe/Berlin")
+        df = pd.DataFrame({"y": np.arange(5.0) + idx}, index=pd.Index(t, name="t"))
+        df.attrs["in_idx"] = idx
+        frames[f"d{idx}"] = df
+    dataAnalysis.dict2h5(frames, zoned)
+    serial = dataAnalysis.h52dict(zoned)
+    parallel = dataAnalysis.h52dict(zoned, workers=2)
+    for key, df in serial.items():
+        pd.testing.assert_frame_equal(parallel[key], df)
+    df["state"] = pd.Categorical(["a", "b", "a", "b", "a"])
+    unpacked = dataAnalysis.unpackFrames(*dataAnalysis.packFrames([("/d", df, {})]))
+    pd.testing.assert_frame_equal(unpacked["/d"], df)
+
+    # without shared memory blocks, all arrays are pickled
+    monkeypatch.setattr(dataAnalysis, "SHMBLOCKS", False)
+    name, layout = dataAnalysis.packFrames([("/d", df, {})])
+    assert name is None
+    pd.testing.assert_frame_equal(dataAnalysis.unpackFrames(name, layout)["/d"], df)
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork" or not os.path.isdir("/dev/shm"),
+    reason="needs forked workers and /dev/shm",
+)
+def test_parallelReadCleanup(tmpdir, monkeypatch):
+    # if a chunk fails, the blocks of the other chunks are removed. the workers are
+    # forked, so they see the patch
+    path = mkStore(str(tmpdir / "parallel.h5"), n=25)
+    packFrames = dataAnalysis.packFrames
+
+    def failing(frames):
+        if frames[0][0] == "/d0":
+            raise ValueError("broken chunk")
+        return packFrames(frames)
+
+    monkeypatch.setattr(dataAnalysis, "packFrames", failing)
+    blocks = set(os.listdir("/dev/shm"))
+    with pytest.raises(ValueError):
+        dataAnalysis.h52dict(path, workers=2)
+    assert set(os.listdir("/dev/shm")) <= blocks
+
+
+def test_multiFile(tmpdir):
+    folder = tmpdir / "campaign"
+    (folder / "sub").ensure(dir=True)
+    mkStore(str(folder / "b0.h5"), n=3)
+    mkStore(str(folder / "sub" / "b1.h5"), n=4)
+    with pd.HDFStore(str(folder / "sub" / "b1.h5")) as store:
+        store.remove(dataAnalysis.METAKEY)
+    (folder / "broken.h5").write("no hdf5")
+
+    with dataAnalysis.read(str(folder)) as data:
+        assert len(data) == 7
+        assert list(data.errors) == [Path(folder / "broken.h5")]
+        assert "/sub/b1/d3" in data and "/b0/d3" not in data
+        assert data["/sub/b1/d2"].attrs["in_idx"] == 2
+        meta = dataAnalysis.getMetaMatrix(data)
+        assert list(meta.index[:4]) == ["/b0/d0", "/b0/d1", "/b0/d2", "/sub/b1/d0"]
+        assert meta.loc["/b0/d2", "in_half"] == 1.0
+
+    with dataAnalysis.read(str(folder / "*.h5")) as data:
+        assert list(data) == ["/b0/d0", "/b0/d1", "/b0/d2"]
+
+
+def test_raggedData(tmpdir):
+    path = mkStore(str(tmpdir / "ragged.h5"))
+    with dataAnalysis.read(path) as data:
+        frames = dict((k, v.copy()) for k, v in data.items())
+    data = dataAnalysis.read(path, packed=True, dtype=np.float32)
+    assert list(data) == list(frames)
+    assert data.offsets[-1] == len(data.x) == 1000
+    assert data.y.dtype == np.float32
+
+    df = data["/d3"]
+    pd.testing.assert_frame_equal(df, frames["/d3"], check_dtype=False)
+    assert df.attrs["in_idx"] == 3
+    assert np.shares_memory(df.values, data.y)
+    x, y = data.series("/d3", "y")
+    assert np.shares_memory(y, data.y) and y[0] == 3.0
+
+    assert list(data.reduce(np.maximum, "y")) == list(range(10))
+    meta = dataAnalysis.getMetaMatrix(data)
+    assert list(meta.columns) == ["in_half", "in_idx"]
+
+    # lazy sources are packed frame by frame, without filling their cache
+    with dataAnalysis.LazyDataDict(path) as lazy:
+        packed = dataAnalysis.RaggedData.fromFrames(lazy)
+        assert not lazy.cache
+    unpacked = dataAnalysis.RaggedData.fromFrames(frames)
+    assert np.array_equal(packed.y, unpacked.y) and np.array_equal(packed.x, unpacked.x)
+    assert packed["/d3"].attrs["in_idx"] == 3
+
+    # columns missing in a frame are NaN, other columns are dropped
+    mixed = {"a": frames["/d3"].assign(s="x"), "b": frames["/d4"].assign(z=1)}
+    packed = dataAnalysis.RaggedData.fromFrames(mixed)
+    assert list(packed.columns) == ["y", "z"]
+    assert np.isnan(packed.series("a", "z")[1]).all()
+
+
+def test_memmapCache(tmpdir):
+    path = mkStore(str(tmpdir / "cached.h5"))
+    cache = dataAnalysis.cachePath(path)
+    assert dataAnalysis.cache2dict(cache, path) is None
+
+    data = dataAnalysis.read(path, cache=True)
+    assert cache.is_dir()
+    assert isinstance(data.y, np.memmap) and data.y.flags.f_contiguous
+    x, y = data.series("/d3", "y")
+    assert isinstance(y, np.memmap) and y.flags.c_contiguous and y[0] == 3.0
+    assert data["/d4"].attrs["in_idx"] == 4
+    pd.testing.assert_frame_equal(
+        data["/d3"], dataAnalysis.h52dict(path)["/d3"], check_like=True
+    )
+
+    mtime = cache.stat().st_mtime_ns
+    data = dataAnalysis.read(path, cache=True)
+    assert cache.stat().st_mtime_ns == mtime
+
+    # the cache is rebuilt, once the source changes
+    dataAnalysis.dict2h5(dict(mkFrames(3)), path, mode="w")
+    assert dataAnalysis.cache2dict(cache, path) is None
+    assert len(dataAnalysis.read(path, cache=True)) == 3
+
+
+def test_streamingWriter(tmpdir):
+    path = str(tmpdir / "stream.h5")
+    items = list(mkFrames(6))
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupted():
+        for idx, item in enumerate(items):
+            if idx == 4:
+                raise Interrupted()
+            yield item
+
+    with pytest.raises(Interrupted):
+        dataAnalysis.iter2h5(interrupted(), path, complevel=5, complib="zlib")
+    with pd.HDFStore(path) as store:
+        assert dataAnalysis.readMetaIndex(store) is None
+        # pretend the write of d3 was interrupted
+        store._handle.root._v_attrs.parcoords_pending = "/d3"
+
+    written = []
+
+    def resumed():
+        for key, df in items:
+            written.append(key)
+            yield key, df
+
+    dataAnalysis.iter2h5(resumed(), path, resume=True, format="table", chunksize=7)
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is not None
+        assert sorted(data) == [f"/d{x}" for x in range(6)]
+        assert data["/d5"]["y"].iloc[-1] == 5.0
+        assert data.getattrs("/d1")["in_idx"] == 1
+        assert data.get_storer("/d4").is_table
+        assert not data.get_storer("/d1").is_table
+        assert data.get_storer("/d3").is_table
+
+    # append mode keeps the other keys in the index
+    dataAnalysis.dict2h5(dict(mkFrames(2, offset=10)), path)
+    with dataAnalysis.LazyDataDict(path) as data:
+        assert data.index is not None and len(data) == 8
+
+
+def test_stepCharacteristics(tmpdir, monkeypatch):
+    x = np.array([0.0, 1, 2, 3, 4, 0, 1, 2, 0, 1, 2, 3])
+    y = np.array([0.0, 0.96, 1.2, 1.0, 1.01, 0.0, 0.5, 0.6, 1.0, 1.0, 1.0, 1.0])
+    offsets = np.array([0, 5, 8, 12])
+    res = dataAnalysis.stepCharacteristics(x, y, offsets)
+    np.testing.assert_allclose(res["os"], [0.2, 0, 0])
+    np.testing.assert_allclose(res["tr"], [1, 0, 0])
+    np.testing.assert_allclose(res["tm"], [2, -10, -10])
+    np.testing.assert_allclose(res["tp"], [2, 2, 0])
+    np.testing.assert_allclose(res["ess"], [-0.01, 0.4, 0])
+    np.testing.assert_allclose(res["rms"][1], np.sqrt((0.25 + 0.36) / 3))
+    np.testing.assert_allclose(res["iae"], [np.trapz(abs(1 - y[:5])), 1.2, 0])
+    np.testing.assert_allclose(res["ise"][1], np.trapz((1 - y[5:8]) ** 2))
+    np.testing.assert_allclose(res["itae"][1], np.trapz(x[5:8] * abs(1 - y[5:8])))
+
+    # as a calc callback, cached per dataset and calculated all at once
+    monkeypatch.setattr(dataAnalysis, "calcCallbacks", [])
+    path = mkStore(str(tmpdir / "characteristics.h5"))
+    cb = dataAnalysis.characteristicsCallback(target=5.0, names=("os", "ess"))
+    assert cb.inputs == ("y",) and cb.outputs == ("out_os", "out_ess") and cb.batch
+    calls = []
+    stepCharacteristics = dataAnalysis.stepCharacteristics
+
+    def counted(x, y, offsets, *args):
+        calls.append(len(offsets) - 1)
+        return stepCharacteristics(x, y, offsets, *args)
+
+    monkeypatch.setattr(dataAnalysis, "stepCharacteristics", counted)
+    with dataAnalysis.read(path) as data:
+        assert calls == [10]
+        assert data.calcreport[cb.name]["calculated"] == 10
+        assert data.getattrs("/d7")["out_os"] == 2.0
+        assert data.getattrs("/d3")["out_ess"] == 2.0
+        assert "out_ess" in dataAnalysis.getMetaMatrix(data).columns
+        report = dataAnalysis.doCalculations(data, persist=False)
+        assert report[cb.name]["cached"] == 10
+    # persisted results are cached without reading the series
+    dataAnalysis.read(path, persist=True).close()
+    with dataAnalysis.read(path) as data:
+        assert data.calcreport[cb.name]["cached"] == 10
+        assert not data.cache
+        # only the changed datasets are calculated again
+        data.getattrs("/d4")[cb.cachekey] = None
+        report = dataAnalysis.doCalculations(data)
+        assert report[cb.name]["calculated"] == 1
+        assert calls == [10, 10, 1]
+        # split between the workers
+        for key in ("/d4", "/d5"):
+            data.getattrs(key)[cb.cachekey] = None
+            data.getattrs(key)["out_ess"] = None
+        report = dataAnalysis.doCalculations(data, workers=2)
+        assert report[cb.name]["calculated"] == 2
+        assert data.getattrs("/d5")["out_ess"] == 0.0
+
+    # all at once, packed series without col or without rows are skipped
+    frames = dict(mkFrames(3))
+    frames["noy"] = pd.DataFrame({"z": [1.0, 2.0]})
+    frames["empty"] = pd.DataFrame({"y": []}, dtype=float)
+    frames["last"] = next(mkFrames(1, offset=7))[1]
+    data = dataAnalysis.RaggedData.fromFrames(frames)
+    dataAnalysis.addCharacteristics(data, target=5.0, names=("os",))
+    assert data.getattrs("last")["out_os"] == 2.0
+    assert "out_os" not in data.getattrs("noy")
+    assert "out_os" not in data.getattrs("empty")
+    dataAnalysis.addCharacteristics(data, col="missing")
+
+
+def test_envelopeBands():
+    rng = np.random.default_rng(0)
+    xs = [np.sort(rng.random(n)) * k for n, k in [(5, 1), (1, 2), (7, 3), (3, 0.5)]]
+    ys = [rng.random(len(x)) for x in xs]
+    offsets = np.cumsum([0] + [len(x) for x in xs])
+    grid = np.linspace(0, 3, 50)
+    res = dataAnalysis.resampleSeries(
+        np.concatenate(xs), np.concatenate(ys), offsets, grid
+    )
+    for idx, (x, y) in enumerate(zip(xs, ys)):
+        expected = np.interp(grid, x, y)
+        expected[(grid < x[0]) | (grid > x[-1])] = np.nan
+        np.testing.assert_allclose(res[idx], expected)
+
+    vals = rng.random((20, 30))
+    vals[rng.random(vals.shape) < 0.3] = np.nan
+    vals[:, 3] = np.nan
+    percentiles = [0, 5, 50, 95, 100]
+    res = dataAnalysis.percentileBands(vals, percentiles)
+    with pytest.warns(RuntimeWarning):
+        expected = np.nanpercentile(vals, percentiles, axis=0)
+    np.testing.assert_allclose(res, expected)
+    assert np.isnan(dataAnalysis.percentileBands(vals[:0], percentiles)).all()
+
+
+def double(df):
+    return {"out_double": df.attrs["in_idx"] * 2}
+
+
+def fromDouble(df):
+    if df.attrs["in_idx"] == 3:
+        raise ValueError("no 3")
+    return {"out_sum": df.attrs["out_double"] + df["y"].iloc[0]}
+
+
+def test_calcPipeline(tmpdir, monkeypatch):
+    monkeypatch.setattr(dataAnalysis, "calcCallbacks", [])
+    path = mkStore(str(tmpdir / "calc.h5"))
+    calls = []
+    dataAnalysis.addCalcCallback(lambda dfs: calls.append(len(dfs)), name="legacy")
+    second = dataAnalysis.addCalcCallback(fromDouble, ["out_double", "y"], ["out_sum"])
+    first = dataAnalysis.addCalcCallback(double, ["in_idx"], ["out_double"])
+    stages = dataAnalysis.calcStages(dataAnalysis.calcCallbacks)
+    assert [[cb.name for cb in x] for x in stages] == [
+        ["legacy"],
+        ["double"],
+        ["fromDouble"],
+    ]
+    assert stages[1] == [first] and stages[2] == [second]
+
+    mtime = os.stat(path).st_mtime_ns
+    with dataAnalysis.read(path) as data:
+        report = data.calcreport
+        assert calls == [10]
+        assert report["double"]["calculated"] == 10
+        assert report["fromDouble"]["calculated"] == 9
+        assert isinstance(report["fromDouble"]["errors"]["/d3"], ValueError)
+        assert data.getattrs("/d4")["out_sum"] == 12.0
+        assert "_calc_double" not in dataAnalysis.getMetaMatrix(data).columns
+
+    # the results are only written into the source if asked for
+    assert os.stat(path).st_mtime_ns == mtime
+    with dataAnalysis.read(path, persist=True) as data:
+        assert data.calcreport["double"]["calculated"] == 10
+
+    # the results were persisted, only the failed dataset is calculated again
+    with dataAnalysis.read(path) as data:
+        assert data.index is not None
+        # the series of cached datasets are not read
+        assert list(data.cache) == ["/d3"]
+        report = data.calcreport
+        assert report["double"]["cached"] == 10
+        assert report["fromDouble"]["cached"] == 9
+        assert report["fromDouble"]["calculated"] == 0
+        assert data.getattrs("/d4")["out_sum"] == 12.0
+        # in_idx of /d4 changes, so both stages run for it
+        data.getattrs("/d4")["in_idx"] = 5
+        report = dataAnalysis.doCalculations(data, workers=2)
+        assert report["double"]["calculated"] == 1
+        assert report["fromDouble"]["calculated"] == 1
+        assert data.getattrs("/d4")["out_sum"] == 14.0
+
+    # the frames are calculated in batches
+    batches = []
+    runCalcBatch = dataAnalysis.runCalcBatch
+
+    def recorded(batch, *args):
+        batches.append(len(batch))
+        return runCalcBatch(batch, *args)
+
+    monkeypatch.setattr(dataAnalysis, "runCalcBatch", recorded)
+    monkeypatch.setattr(dataAnalysis, "CALCBATCHSIZE", 1)
+    with dataAnalysis.read(mkStore(str(tmpdir / "batches.h5"))) as data:
+        assert batches == [1] * 20
+        assert data.getattrs("/d4")["out_sum"] == 12.0
+
+    # callbacks that cannot be sent to the workers run here
+    monkeypatch.setattr(dataAnalysis, "CALCWORKERS", 2)
+    dataAnalysis.addCalcCallback(
+        lambda df: {"out_local": 1}, ["in_idx"], ["out_local"], name="local"
+    )
+    with dataAnalysis.read(path) as data:
+        report = data.calcreport
+        assert report["local"]["calculated"] == 10
+        assert report["local"]["fallback"] is not None
+        assert report["double"]["fallback"] is None
+        assert data.getattrs("/d4")["out_local"] == 1
+
+    # the source is closed if the calculations fail
+    def failing(*args, **kwargs):
+        raise RuntimeError()
+
+    monkeypatch.setattr(dataAnalysis, "doCalculations", failing)
+    with pytest.raises(RuntimeError):
+        dataAnalysis.read(path)
+    with pd.HDFStore(path, "a") as store:
+        assert "/d4" in store
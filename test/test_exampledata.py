@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+from parcoords import exampledata
+
+
+def test_stepResponses():
+    omegas = np.array([1.0, 3.0, 10.0, 2.0, 5.0])
+    zetas = np.array([0.0, 0.3, 1.0, 1.5, 2.0])
+    t, y = exampledata.stepResponses(omegas, zetas, 100)
+    for idx, (omega, zeta) in enumerate(zip(omegas, zetas)):
+        tf = signal.TransferFunction([omega ** 2], [1, 2 * zeta * omega, omega ** 2])
+        ts, ys = tf.step()
+        np.testing.assert_allclose(t[idx], ts, atol=1e-12)
+        np.testing.assert_allclose(y[idx], ys, atol=1e-12)
+
+
+def test_createExampleData():
+    serial = list(exampledata.createExampleData(3, 4, samples=50, nparams=2))
+    parallel = list(
+        exampledata.createExampleData(3, 4, samples=50, nparams=2, workers=2)
+    )
+    assert [x[0] for x in serial] == [f"d{x}" for x in range(12)]
+    assert [x[0] for x in parallel] == [x[0] for x in serial]
+    for (_, a), (_, b) in zip(serial, parallel):
+        pd.testing.assert_frame_equal(a, b)
+        assert a.attrs == b.attrs
+    assert len(serial[5][1]) == 50
+    assert set(serial[5][1].attrs) >= {"in_omega", "in_zeta", "in_p0", "in_p1"}
+
+
+def test_exampleCache(tmpdir):
+    exampledata.TMPPATH = str(tmpdir / "example.h5")
+    path = exampledata.getExampleData(2, 2, samples=20)
+    mtime = path.stat().st_mtime_ns
+    assert exampledata.getExampleData(2, 2, samples=20).stat().st_mtime_ns == mtime
+    with pd.HDFStore(exampledata.getExampleData(2, 3, samples=20)) as store:
+        assert len(store.keys()) == 7